@@ -15,17 +15,126 @@ Module for handling Gitlab calls.
         gitlab.user: admin
         gitlab.api: '432432432432432'
         gitlab.url: 'https://gitlab.domain.com'
+
+    API v3 is used by default. Gitlab versions without it, and mirror
+    updates, need API v4, which only accepts token authentication::
+
+        gitlab.api_version: 4
+
+    Bulk functions run their writes in parallel, up to ``gitlab.workers``
+    (default 4) at a time::
+
+        gitlab.workers: 8
+
+    With aiohttp installed, the ``*_list_all`` functions can instead
+    pipeline their reads from a single thread, with up to
+    ``gitlab.concurrency`` (default 50) requests in flight::
+
+        gitlab.bulk_backend: asyncio
+        gitlab.concurrency: 100
+
+    When given ``fields``, project_get, project_list and user_list can
+    read through the GraphQL API instead, fetching only those fields.
+    They use the REST API when no fields are requested, when GraphQL is
+    unavailable or when a field has no GraphQL equivalent::
+
+        gitlab.read_backend: graphql
+
+    Several Gitlab instances can be configured as named profiles, each
+    with its own credentials, settings, connection pool and optional
+    ``gitlab.rate_limit`` in requests per second, covering every API call
+    but the password login. Every function takes ``profile`` to target one
+    of them, and ``gitlab.multi`` runs a function against several::
+
+        gitlab_dr:
+          gitlab.url: 'https://gitlab-dr.domain.com'
+          gitlab.token: '432432432432432'
+          gitlab.workers: 2
+          gitlab.rate_limit: 10
+
+    With ``gitlab.write_queue`` (or ``queue=True`` on a call), project,
+    hook and deploy key writes are recorded instead of made, merged per
+    object and made in dependency order by ``gitlab.flush``, e.g. from a
+    final ``gitlab.flushed`` state::
+
+        gitlab.write_queue: True
+
+    Imports, deletions and mirror updates finish in the background on the
+    Gitlab server. The ``*_submit`` functions start them and return a job
+    handle at once; ``gitlab.wait`` then polls many handles together.
+    Mirror updates need API v4.
+
+    ``gitlab.drift`` compares the desired configuration kept in pillar
+    with the instance, reading only through bulk listings::
+
+        gitlab:
+          projects:
+            namespace/repository:
+              description: 'nova project'
+              hooks:
+                - http://url_of_hook
+              deploykeys:
+                title_of_key: public_key
+              branches:
+                - staging
+                - release-1: v1.0
+          users:
+            - username: kevinquinnyo
+              name: 'Kevin Quinn'
+              email: kevin@example.com
 '''
 
 from __future__ import absolute_import
 
-# Import third party libs
-HAS_GITLAB = False
-try:
-    from gitlab import Gitlab
-    HAS_GITLAB = True
-except ImportError:
-    pass
+# Import python libs
+import hashlib
+import json
+import os
+import threading
+import time
+from importlib.util import find_spec
+from urllib.parse import quote
+
+# Import salt libs
+from salt.exceptions import CommandExecutionError
+
+# Check for third party libs without importing them: they are only
+# imported when the module is first used, so minions that never manage
+# Gitlab do not pay for them when loading their modules
+HAS_GITLAB = find_spec('gitlab') is not None and \
+    find_spec('requests') is not None
+HAS_AIOHTTP = find_spec('aiohttp') is not None
+
+
+ACCESS_LEVELS = {'guest': 10,
+                 'reporter': 20,
+                 'developer': 30,
+                 'master': 40,
+                 'maintainer': 40,
+                 'owner': 50}
+
+
+# REST field names and the GraphQL fields they are read from
+GRAPHQL_FIELDS = {
+    'projects': {'id': 'id',
+                 'name': 'name',
+                 'path': 'path',
+                 'path_with_namespace': 'fullPath',
+                 'description': 'description',
+                 'web_url': 'webUrl',
+                 'visibility': 'visibility',
+                 'archived': 'archived',
+                 'created_at': 'createdAt',
+                 'last_activity_at': 'lastActivityAt',
+                 'http_url_to_repo': 'httpUrlToRepo',
+                 'ssh_url_to_repo': 'sshUrlToRepo'},
+    'users': {'id': 'id',
+              'name': 'name',
+              'username': 'username',
+              'state': 'state',
+              'web_url': 'webUrl',
+              'avatar_url': 'avatarUrl'},
+}
 
 
 def __virtual__():
@@ -41,29 +150,346 @@ __opts__ = {}
 
 
 def _get_project_by_id(git, id):
-    selected_project = git.getproject(id)
-    return selected_project
+    return _request(git, 'get', 'projects/{0}'.format(id))
+
+
+# Held while an index is listed, so concurrent workers list it only once
+_INDEX_LOCK = threading.RLock()
+
+# Number of API requests made by the current thread, see _session
+_CALLS = threading.local()
+
+
+def _project_index(git):
+    '''
+    Return the projects of this Gitlab instance indexed by
+    path_with_namespace, listing them only once per run
+    '''
+    key = 'gitlab.projects.{0}'.format(git.salt_profile)
+    with _INDEX_LOCK:
+        if key not in __context__:
+            __context__[key] = dict(
+                (project.get('path_with_namespace'), project)
+                for project in _paginate(git, 'projects'))
+    return __context__[key]
+
+
+def _clear_project_index(git):
+    __context__.pop('gitlab.projects.{0}'.format(git.salt_profile), None)
+
+
+def _drop_from_project_index(git, project_id):
+    '''
+    Forget a deleted project without listing the projects again
+    '''
+    key = 'gitlab.projects.{0}'.format(git.salt_profile)
+    for path, project in list(__context__.get(key, {}).items()):
+        if project.get('id') == project_id:
+            del __context__[key][path]
 
 
 def _get_project_by_name(git, name):
-    selected_project = None
     if name.startswith('/'):
         name = name[1:]
-    for project in git.getprojects():
-        if project.get('path_with_namespace') == name:
-            selected_project = project
-            break
-    return selected_project
+    return _project_index(git).get(name)
+
+
+def _headers(git):
+    '''
+    Return the client's headers, without the ``Connection: close`` its
+    password login sets, which would defeat the connection pool
+    '''
+    return dict((name, value)
+                for name, value in getattr(git, 'headers', {}).items()
+                if name.lower() != 'connection')
+
+
+def _session(git):
+    '''
+    Return the HTTP session used for the raw API calls made on behalf of
+    this client, so they share one connection pool
+    '''
+    if getattr(git, 'salt_session', None) is None:
+        import requests
+        session = requests.Session()
+        session.headers.update(_headers(git))
+        session.verify = getattr(git, 'verify_ssl', True)
+        session.auth = getattr(git, 'auth', None)
+        send = session.request
+
+        def _throttled(*args, **kwargs):
+            time.sleep(git.salt_limiter.reserve())
+            _CALLS.count = getattr(_CALLS, 'count', 0) + 1
+            return send(*args, **kwargs)
+
+        session.request = _throttled
+        git.salt_session = session
+    return git.salt_session
+
+
+def _api_v3(git):
+    return git.api_url.rstrip('/').endswith('/v3')
+
+
+def _response(git, method, path, **kwargs):
+    '''
+    Call the Gitlab API through the client's pooled, rate limited session.
+    Return the HTTP response, for callers that need its status.
+    '''
+    return _session(git).request(method,
+                                 '{0}/{1}'.format(git.api_url, path),
+                                 timeout=getattr(git, 'timeout', None),
+                                 **kwargs)
+
+
+def _request(git, method, path, **kwargs):
+    '''
+    Call the Gitlab API through the client's pooled, rate limited session.
+    Return the decoded response, or None on failure.
+    '''
+    resp = _response(git, method, path, **kwargs)
+    if not resp.ok:
+        return None
+    if not resp.content:
+        return True
+    return resp.json()
+
+
+def _paginate(git, path, per_page=100, **params):
+    '''
+    Yield every item of a paginated API listing, fetching one page at a
+    time as the caller consumes them. A failed page raises, rather than
+    passing a partial listing off as complete.
+    '''
+    params['per_page'] = per_page
+    page = 1
+    while page:
+        params['page'] = page
+        resp = _session(git).get('{0}/{1}'.format(git.api_url, path),
+                                 params=params,
+                                 timeout=getattr(git, 'timeout', None))
+        if not resp.ok:
+            raise CommandExecutionError(
+                'Unable to list {0} (page {1}): HTTP {2}'.format(
+                    path, page, resp.status_code))
+        for item in resp.json():
+            yield item
+        page = resp.headers.get('X-Next-Page')
+
+
+def _get_group(git, group):
+    if str(group).startswith('/'):
+        group = group[1:]
+    return _request(git, 'get', 'groups/{0}'.format(quote(str(group), safe='')))
+
+
+def _group_projects(git, group, include_subgroups=False):
+    '''
+    Yield the projects of a group, optionally including its subgroups
+    '''
+    path = 'groups/{0}/projects'.format(group['id'])
+    if include_subgroups:
+        return _paginate(git, path, include_subgroups='true')
+    return _paginate(git, path)
+
+
+def _group_apply(git, group, func, include_subgroups=False, workers=1):
+    '''
+    Apply func to every project of a group, streaming the project listing
+    into the worker pool. Return the results by project path.
+    '''
+    group = _get_group(git, group)
+    if not group:
+        return {'Error': 'Unable to resolve group'}
+
+    def _apply(project):
+        return project.get('path_with_namespace'), func(project)
+
+    return dict(_parallel(_apply,
+                          _group_projects(git, group, include_subgroups),
+                          workers))
+
+
+def _with_name(fields):
+    '''
+    Add the name to the requested fields, as the results are keyed by it
+    '''
+    if fields and 'name' not in fields:
+        fields = ['name'] + list(fields)
+    return fields
+
+
+def _select_fields(items, fields):
+    for item in items:
+        if fields:
+            item = dict((field, item.get(field)) for field in fields)
+        yield item
+
+
+def _graphql(git, query, variables=None):
+    '''
+    Run a GraphQL query. Return its data, or None when the GraphQL API is
+    unavailable or the query failed.
+    '''
+    import requests
+    try:
+        resp = _session(git).post('{0}/api/graphql'.format(git.host),
+                                  json={'query': query,
+                                        'variables': variables or {}},
+                                  timeout=getattr(git, 'timeout', None))
+        data = resp.json() if resp.ok else {}
+    except (requests.RequestException, ValueError):
+        return None
+    if data.get('errors') or not data.get('data'):
+        return None
+    return data['data']
+
+
+def _graphql_fields(kind, fields):
+    '''
+    Return the GraphQL selection for the given REST fields, or None if
+    none are given (the full REST record is wanted) or one of them cannot
+    be read through GraphQL
+    '''
+    mapping = GRAPHQL_FIELDS[kind]
+    if not fields:
+        return None
+    if not all(field in mapping for field in fields):
+        return None
+    return ' '.join(mapping[field] for field in fields)
+
+
+def _from_graphql(kind, node, fields):
+    '''
+    Convert a GraphQL node to the REST representation of its fields
+    '''
+    ret = {}
+    for field in fields:
+        value = node.get(GRAPHQL_FIELDS[kind][field])
+        if field == 'id' and value:
+            # Global IDs look like gid://gitlab/Project/12
+            value = int(value.rsplit('/', 1)[-1])
+        ret[field] = value
+    return ret
+
+
+def _use_graphql(git, kind, fields):
+    if git.salt_config['read_backend'] != 'graphql':
+        return None
+    return _graphql_fields(kind, fields)
+
+
+def _read_backend_list(git, kind, fields, per_page=100):
+    '''
+    List every project or user through GraphQL with cursor pagination,
+    yielding one page at a time. Return None when the REST API must be
+    used instead. A failed later page raises, rather than passing a
+    partial listing off as complete.
+    '''
+    selection = _use_graphql(git, kind, fields)
+    if selection is None:
+        return None
+    # Like the REST listing, only list the projects the user is a member of
+    arguments = 'membership: true, ' if kind == 'projects' else ''
+    query = ('query($first: Int, $after: String) {{ {0}({1}first: $first, '
+             'after: $after) {{ nodes {{ {2} }} pageInfo {{ endCursor '
+             'hasNextPage }} }} }}').format(kind, arguments, selection)
+    page = _graphql(git, query, {'first': per_page})
+    if page is None:
+        return None
+
+    def _nodes(page):
+        while True:
+            for node in page[kind]['nodes']:
+                yield _from_graphql(kind, node, fields)
+            if not page[kind]['pageInfo']['hasNextPage']:
+                return
+            cursor = page[kind]['pageInfo']['endCursor']
+            page = _graphql(git, query, {'first': per_page, 'after': cursor})
+            if page is None:
+                raise CommandExecutionError(
+                    'Unable to list {0} through GraphQL after cursor '
+                    '{1}'.format(kind, cursor))
+
+    return _nodes(page)
+
+
+def _read_backend_project(git, name, fields):
+    '''
+    Read one project by path through GraphQL. Return None when the REST
+    API must be used instead, or False when the project does not exist.
+    '''
+    selection = _use_graphql(git, 'projects', fields)
+    if selection is None:
+        return None
+    data = _graphql(git, 'query($path: ID!) {{ project(fullPath: $path) '
+                         '{{ {0} }} }}'.format(selection),
+                    {'path': name.lstrip('/')})
+    if data is None:
+        return None
+    if not data.get('project'):
+        return False
+    return _from_graphql('projects', data['project'], fields)
 
 
-def auth(**connection_args):
+def _get_workers(git):
+    return git.salt_config['workers']
+
+
+def _parallel(func, items, workers):
+    '''
+    Apply func to every item, using at most ``workers`` threads. Items
+    may also be a generator, which is consumed as the work is handed out.
+    '''
+    if isinstance(items, (list, tuple)):
+        workers = min(workers, len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(workers)
+    try:
+        return list(pool.imap(func, items))
+    finally:
+        pool.close()
+        pool.join()
+
+
+class _RateLimiter(object):
+    '''
+    Spread the requests to one Gitlab instance to at most ``rate`` per
+    second, across all threads
+    '''
+    def __init__(self, rate=None):
+        self.interval = 1.0 / float(rate) if rate else 0
+        self.lock = threading.Lock()
+        self.next_slot = 0
+
+    def reserve(self):
+        '''
+        Reserve the next request slot and return how long to wait for it
+        '''
+        if not self.interval:
+            return 0
+        with self.lock:
+            now = time.time()
+            delay = max(0, self.next_slot - now)
+            self.next_slot = max(now, self.next_slot) + self.interval
+        return delay
+
+
+def auth(profile=None, **connection_args):
     '''
     Set up gitlab credentials
 
     Only intended to be used within Gitlab-enabled modules
+
+    The client of each profile is built once per run and reused, together
+    with its connection pool, rate limit and caches.
     '''
-   
-    prefix = "gitlab."
+    if profile:
+        prefix = profile + ":gitlab."
+    else:
+        prefix = "gitlab."
 
     # look in connection_args first, then default to config file
     def get(key, default=None):
@@ -74,14 +500,64 @@ def auth(**connection_args):
     password = get('password', 'ADMIN')
     token = get('token')
     url = get('url', 'https://localhost/')
+
+    # Calls overriding the credentials or settings get their own client,
+    # settings and caches
+    overrides = sorted((key, str(value))
+                       for key, value in connection_args.items()
+                       if key.startswith('connection_'))
+    digest = hashlib.sha256(repr((user, password, token, overrides))
+                            .encode('utf-8')).hexdigest()[:16]
+    key = 'gitlab.client.{0}.{1}.{2}'.format(profile, url, digest)
+    if key in __context__:
+        return __context__[key]
+    from gitlab import Gitlab
     if token:
         git = Gitlab(url, token=token)
     else:
         git = Gitlab(url)
         git.login(user, password)
+    if int(get('api_version', 3)) >= 4:
+        # The client library only knows API v3
+        for attr in ('api_url', 'projects_url', 'users_url', 'keys_url',
+                     'groups_url', 'search_url', 'hook_url'):
+            setattr(git, attr,
+                    getattr(git, attr).replace('/api/v3', '/api/v4', 1))
+    git.salt_profile = '{0}.{1}.{2}'.format(profile, url, digest)
+    git.salt_config = {
+        'workers': int(get('workers', 4)),
+        'concurrency': int(get('concurrency', 50)),
+        'bulk_backend': get('bulk_backend', 'threads'),
+        'read_backend': get('read_backend', 'rest'),
+        'write_queue': bool(get('write_queue', False)),
+    }
+    git.salt_limiter = _RateLimiter(get('rate_limit'))
+    __context__[key] = git
     return git
 
 
+def multi(fun, profiles, *args, **kwargs):
+    '''
+    Run a function of this module against several profiles concurrently
+
+    Returns the result per profile.
+
+    CLI Examples:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.multi project_list '[gitlab_prod, gitlab_dr]'
+        salt '*' gitlab.multi branches_create '[gitlab_prod, gitlab_dr]' my_project '[staging]'
+    '''
+    kwargs = dict((key, value) for key, value in kwargs.items()
+                  if not key.startswith('__'))
+
+    def _run(profile):
+        return __salt__['gitlab.' + fun](*args, profile=profile, **kwargs)
+
+    return dict(zip(profiles, _parallel(_run, list(profiles), len(profiles))))
+
+
 def hook_get(hook_url, project_id=None, project_name=None, **connection_args):
     '''
     Return a specific endpoint (gitlab endpoint-get)
@@ -99,7 +575,7 @@ def hook_get(hook_url, project_id=None, project_name=None, **connection_args):
         project = _get_project_by_id(git, project_id)
     if not project:
         return {'Error': 'Unable to resolve project'}
-    for hook in git.getprojecthooks(project.get('id')):
+    for hook in _paginate(git, 'projects/{0}/hooks'.format(project['id'])):
         if hook.get('url') == hook_url:
             return {hook.get('url'): hook}
     return {'Error': 'Could not find hook for the specified project'}
@@ -123,13 +599,14 @@ def hook_list(project_id=None, project_name=None, **connection_args):
         project = _get_project_by_id(git, project_id)
     if not project:
         return {'Error': 'Unable to resolve project'}
-    for hook in git.getprojecthooks(project.get('id')):
+    for hook in _paginate(git, 'projects/{0}/hooks'.format(project['id'])):
         ret[hook.get('url')] = hook
     return ret
 
 
 def hook_create(hook_url, issues=False, merge_requests=False, \
-    push=False, tag_push=False, project_id=None, project_name=None, **connection_args):
+    push=False, tag_push=False, project_id=None, project_name=None,
+    queue=None, **connection_args):
     '''
     Create an hook for a project
 
@@ -138,25 +615,40 @@ def hook_create(hook_url, issues=False, merge_requests=False, \
     .. code-block:: bash
 
         salt '*' gitlab.hook_create 'https://hook.url/' push_events=True project_id=300
+        salt '*' gitlab.hook_create 'https://hook.url/' project_name=namespace/path queue=True
     '''
     git = auth(**connection_args)
+    if project_name and _queue_enabled(git, queue):
+        return _enqueue(git, 'hook', project_name, hook_url, 'create',
+                        {'issues': issues, 'push': push,
+                         'merge_requests': merge_requests,
+                         'tag_push': tag_push})
     if project_name:
         project = _get_project_by_name(git, project_name)
     else:
         project = _get_project_by_id(git, project_id)
     if not project:
         return {'Error': 'Unable to resolve project'}
-    create = True
-    for hook in git.getprojecthooks(project.get('id')):
+    _ensure_hook(git, project, hook_url, issues=issues, push=push,
+                 merge_requests=merge_requests, tag_push=tag_push)
+    return hook_get(hook_url, project_id=project['id'], **connection_args)
+
+
+def _ensure_hook(git, project, hook_url, **hook_args):
+    path = 'projects/{0}/hooks'.format(project['id'])
+    for hook in _paginate(git, path):
         if hook.get('url') == hook_url:
-            create = False
-    if create:  
-        git.addprojecthook(project['id'], hook_url, issues=issues, 
-            push=push, merge_requests=merge_requests, tag_push=tag_push)
-    return hook_get(hook_url, project_id=project['id'])
+            return {'created': False}
+    data = dict((event + '_events', value)
+                for event, value in hook_args.items())
+    data['url'] = hook_url
+    if not _request(git, 'post', path, data=data):
+        return {'Error': 'Unable to create hook {0}'.format(hook_url)}
+    return {'created': True}
 
 
-def hook_delete(hook_url, project_id=None, project_name=None, **connection_args):
+def hook_delete(hook_url, project_id=None, project_name=None, queue=None,
+                **connection_args):
     '''
     Delete hook of a Gitlab project
 
@@ -167,20 +659,23 @@ def hook_delete(hook_url, project_id=None, project_name=None, **connection_args)
         salt '*' gitlab.hook_delete 'https://hook.url/' project_id=300
     '''
     git = auth(**connection_args)
+    if project_name and _queue_enabled(git, queue):
+        return _enqueue(git, 'hook', project_name, hook_url, 'delete')
     if project_name:
         project = _get_project_by_name(git, project_name)
     else:
         project = _get_project_by_id(git, project_id)
     if not project:
         return {'Error': 'Unable to resolve project'}
-    for hook in git.getprojecthooks(project.get('id')):
+    for hook in _paginate(git, 'projects/{0}/hooks'.format(project['id'])):
         if hook.get('url') == hook_url:
-            return git.deleteprojecthook(project['id'], hook['id'])
+            return _request(git, 'delete', 'projects/{0}/hooks/{1}'.format(
+                project['id'], hook['id'])) is not None
     return {'Error': 'Could not find hook for the specified project'}
 
 
 def deploykey_create(title, key, project_id=None, project_name=None, 
-                   **connection_args):
+                   queue=None, **connection_args):
     '''
     Add deploy key to Gitlab project
 
@@ -191,22 +686,31 @@ def deploykey_create(title, key, project_id=None, project_name=None,
         salt '*' gitlab.deploykey_create title keyfrsdfdsfds 43
     '''
     git = auth(**connection_args)
+    if project_name and _queue_enabled(git, queue):
+        return _enqueue(git, 'deploykey', project_name, title, 'create',
+                        {'key': key})
     if project_name:
         project = _get_project_by_name(git, project_name)
     else:
         project = _get_project_by_id(git, project_id)
     if not project:
         return {'Error': 'Unable to resolve project'}
-    create = True
-    for dkey in git.getdeploykeys(project['id']):
+    _ensure_deploykey(git, project, title, key)
+    return deploykey_get(title, project_id=project['id'], **connection_args)
+
+
+def _ensure_deploykey(git, project, title, key):
+    path = 'projects/{0}/keys'.format(project['id'])
+    for dkey in _paginate(git, path):
         if dkey.get('title') == title:
-            create = False
-    if create:
-        git.adddeploykey(project['id'], title, key)
-    return deploykey_get(title, project_id=project['id'])
+            return {'created': False}
+    if not _request(git, 'post', path, data={'title': title, 'key': key}):
+        return {'Error': 'Unable to create deploy key {0}'.format(title)}
+    return {'created': True}
 
 
-def deploykey_delete(key_title, project_id=None, project_name=None, **connection_args):
+def deploykey_delete(key_title, project_id=None, project_name=None,
+                     queue=None, **connection_args):
     '''
     Delete a deploy key from Gitlab project
 
@@ -218,15 +722,20 @@ def deploykey_delete(key_title, project_id=None, project_name=None, **connection
         salt '*' gitlab.deploykey_delete key.domain.com project_name=namespace/path
     '''
     git = auth(**connection_args)
+    if project_name and _queue_enabled(git, queue):
+        return _enqueue(git, 'deploykey', project_name, key_title, 'delete')
     if project_name:
         project = _get_project_by_name(git, project_name)
     else:
         project = _get_project_by_id(git, project_id)
     if not project:
         return {'Error': 'Unable to resolve project'}
-    for key in git.listdeploykeys(project.get('id')):
+    for key in _paginate(git, 'projects/{0}/keys'.format(project['id'])):
         if key.get('title') == key_title:
-            git.deletedeploykey(project['id'], key['id'])
+            if _request(git, 'delete', 'projects/{0}/keys/{1}'.format(
+                    project['id'], key['id'])) is None:
+                return {'Error': 'Unable to delete deploy key {0}'.format(
+                    key_title)}
             return 'Gitlab deploy key ID "{0}" deleted'.format(key['id'])
     return {'Error': 'Could not find deploy key for the specified project'}
 
@@ -249,7 +758,7 @@ def deploykey_get(title, project_id=None, project_name=None, **connection_args):
         project = _get_project_by_id(git, project_id)
     if not project:
         return {'Error': 'Unable to resolve project'}
-    for key in git.getdeploykeys(project.get('id')):
+    for key in _paginate(git, 'projects/{0}/keys'.format(project['id'])):
         if key.get('title') == title:
             return {key.get('title'): key}
     return {'Error': 'Could not find deploy key for the specified project'}
@@ -273,30 +782,44 @@ def deploykey_list(project_id=None, project_name=None, **connection_args):
         project = _get_project_by_id(git, project_id)
     if not project:
         return {'Error': 'Unable to resolve project'}
-    for key in git.getdeploykeys(project.get('id')):
+    for key in _paginate(git, 'projects/{0}/keys'.format(project['id'])):
         ret[key.get('title')] = key
     return ret
 
 def project_create(name, description=None, enabled=True, profile=None,
-                  **connection_args):
+                  queue=None, **connection_args):
     '''
-    Create a gitlab project
+    Create a gitlab project, given its path. Missing namespaces are
+    created as groups. ``enabled`` is ignored, as Gitlab projects cannot
+    be disabled.
 
     CLI Examples:
 
     .. code-block:: bash
 
         salt '*' gitlab.project_create nova description='nova project'
-        salt '*' gitlab.project_create test enabled=False
+        salt '*' gitlab.project_create namespace/repository
     '''
-    git = auth(**connection_args)
-    data = git.createproject(name, description=description, enabled=True, profile=profile)
+    git = auth(profile=profile, **connection_args)
+    if _queue_enabled(git, queue):
+        return _enqueue(git, 'project', name, '', 'create',
+                        {'description': description})
+    namespace, _, path = name.lstrip('/').rpartition('/')
+    data = {'name': path, 'path': path, 'description': description}
+    if namespace:
+        namespaces = _ensure_namespaces(git, [namespace], _get_workers(git))
+        if 'Error' in namespaces:
+            return namespaces
+        data['namespace_id'] = namespaces[namespace]
+    data = _request(git, 'post', 'projects', data=data)
+    _clear_project_index(git)
     if not data:
         return {'Error': 'Unable to create project'}
     return project_get(data['id'], profile=profile, **connection_args)
 
 
-def project_delete(project_id=None, name=None, profile=None, **connection_args):
+def project_delete(project_id=None, name=None, profile=None, queue=None,
+                   **connection_args):
     '''
     Delete a project (gitlab project-delete)
 
@@ -304,19 +827,21 @@ def project_delete(project_id=None, name=None, profile=None, **connection_args):
 
     .. code-block:: bash
 
-        salt '*' gitlab.project_delete c965f79c4f864eaaa9c3b41904e67082
-        salt '*' gitlab.project_delete project_id=c965f79c4f864eaaa9c3b41904e67082
-        salt '*' gitlab.project_delete name=demo
+        salt '*' gitlab.project_delete 323
+        salt '*' gitlab.project_delete project_id=323
+        salt '*' gitlab.project_delete name=namespace/demo
     '''
-    git = auth(**connection_args)
+    git = auth(profile=profile, **connection_args)
+    if name and _queue_enabled(git, queue):
+        return _enqueue(git, 'project', name, '', 'delete')
     if name:
-        for project in git.projects.list():
-            if project.name == name:
-                project_id = project.id
-                break
+        project = _get_project_by_name(git, name)
+        project_id = project and project['id']
     if not project_id:
         return {'Error': 'Unable to resolve project id'}
-    git.projects.delete(project_id)
+    if _request(git, 'delete', 'projects/{0}'.format(project_id)) is None:
+        return {'Error': 'Unable to delete project {0}'.format(project_id)}
+    _drop_from_project_index(git, project_id)
     ret = 'Tenant ID {0} deleted'.format(project_id)
     if name:
 
@@ -324,9 +849,10 @@ def project_delete(project_id=None, name=None, profile=None, **connection_args):
     return ret
 
 
-def project_get(project_id=None, name=None, **connection_args):
+def project_get(project_id=None, name=None, fields=None, **connection_args):
     '''
-    Return a specific project
+    Return a specific project, optionally with only the given fields
+    (and its name)
 
     CLI Examples:
 
@@ -335,94 +861,87 @@ def project_get(project_id=None, name=None, **connection_args):
         salt '*' gitlab.project_get 323
         salt '*' gitlab.project_get project_id=323
         salt '*' gitlab.project_get name=namespace/repository
+        salt '*' gitlab.project_get name=namespace/repository fields='[id, description]'
     '''
     git = auth(**connection_args)
+    fields = _with_name(fields)
     ret = {}
+    project = None
     if name:
-        project = _get_project_by_name(git, name)
-    else:
-        project = _get_project_by_id(git, project_id)
+        project = _read_backend_project(git, name, fields)
+    if project is None:
+        if name:
+            project = _get_project_by_name(git, name)
+        else:
+            project = _get_project_by_id(git, project_id)
+        if project and fields:
+            project = next(_select_fields([project], fields))
     if not project:
         return {'Error': 'Error in retrieving project'}
     ret[project.get('name')] = project
     return ret
 
-def project_list(**connection_args):
+def project_list(fields=None, **connection_args):
     '''
-    Return a list of available projects
+    Return a list of available projects, optionally with only the given
+    fields (and their names)
 
     CLI Example:
 
     .. code-block:: bash
 
         salt '*' gitlab.project_list
+        salt '*' gitlab.project_list fields='[id, path_with_namespace]'
     '''
     git = auth(**connection_args)
+    fields = _with_name(fields)
     ret = {}
-    for project in git.getprojects():
+    projects = _read_backend_list(git, 'projects', fields)
+    if projects is None:
+        projects = _select_fields(_project_index(git).values(), fields)
+    for project in projects:
         ret[project.get('name')] = project
     return ret
 
 
-def project_update(project_id=None, name=None, email=None,
-                  enabled=None, **connection_args):
+def project_update(project_id=None, name=None, description=None,
+                   enabled=None, queue=None, **connection_args):
     '''
     Update a project's information (gitlab project-update)
-    The following fields may be updated: name, email, enabled.
-    Can only update name if targeting by ID
+    The following fields may be updated: description. ``enabled`` is
+    ignored, as Gitlab projects cannot be disabled.
+    The project is targeted by ID, or else by path as name.
 
     CLI Examples:
 
     .. code-block:: bash
 
-        salt '*' gitlab.project_update name=admin enabled=True
-        salt '*' gitlab.project_update c965f79c4f864eaaa9c3b41904e67082 name=admin email=admin@domain.com
+        salt '*' gitlab.project_update name=namespace/repository description='nova project'
+        salt '*' gitlab.project_update 323 description='nova project'
     '''
     git = auth(**connection_args)
-    if not project_id:
-        for project in git.projects.list():
-            if project.name == name:
-                project_id = project.id
-                break
-    if not project_id:
+    fields = {}
+    if description is not None:
+        fields['description'] = description
+    if name and not project_id and _queue_enabled(git, queue):
+        return _enqueue(git, 'project', name, '', 'update', fields)
+    if project_id:
+        project = _get_project_by_id(git, project_id)
+    else:
+        project = _get_project_by_name(git, name)
+    if not project:
         return {'Error': 'Unable to resolve project id'}
-
-    project = git.projects.get(project_id)
-    if not name:
-        name = project.name
-    if not email:
-        email = project.email
-    if enabled is None:
-        enabled = project.enabled
-    git.projects.update(project_id, name, email, enabled)
-
-def user_list(**connection_args):
-    '''
-    Return a list of available users
-
-    CLI Example:
-
-    .. code-block:: bash
-
-        salt '*' gitlab.user_list
-    '''
-    git = auth(**connection_args)
-    ret = {}
-    for user in git.getusers():
-        ret[user.get('name')] = user
-    return ret
+    if not _request(git, 'put', 'projects/{0}'.format(project['id']),
+                    data=fields):
+        return {'Error': 'Unable to update project'}
+    _clear_project_index(git)
+    return project_get(project['id'], **connection_args)
 
 def _get_user_by_name(git, username):
-    selected_user = None
-    for user in git.getusers():
-        if user.get('username') == username:
-            selected_user = user
-            break
-    return selected_user
+    return _user_index(git).get(username)
 
 def _get_user_by_id(git, id):
-    selected_user = git.getuser(id)
-    return selected_user
+    return _request(git, 'get', 'users/{0}'.format(id))
 
 def user_get(user_id=None, username=None, **connection_args):
     '''
@@ -447,19 +966,25 @@ def user_get(user_id=None, username=None, **connection_args):
     ret[user.get('username')] = user
     return ret
 
-def user_list(**connection_args):
+def user_list(fields=None, **connection_args):
     '''
-    Return a list of available users
+    Return a list of available users, optionally with only the given
+    fields (and their names)
 
     CLI Example:
 
     .. code-block:: bash
 
         salt '*' gitlab.user_list
+        salt '*' gitlab.user_list fields='[id, username]'
     '''
     git = auth(**connection_args)
+    fields = _with_name(fields)
     ret = {}
-    for user in git.getusers():
+    users = _read_backend_list(git, 'users', fields)
+    if users is None:
+        users = _select_fields(_paginate(git, 'users'), fields)
+    for user in users:
         ret[user.get('name')] = user
     return ret
 
@@ -481,11 +1006,12 @@ def user_create(name,
     if 'can_create_group' not in  connection_args:
         connection_args['can_create_group'] = False
     git = auth(**connection_args)
-    data = git.createuser(name,
-                        username,
-                        password,
-                        email,
-                        **connection_args)
+    user = dict((key, value) for key, value in connection_args.items()
+                if not key.startswith(('connection_', '__')) and
+                key != 'profile')
+    user.update(name=name, username=username, password=password, email=email)
+    data = _request(git, 'post', 'users', data=user)
+    _clear_user_index(git)
     if not data:
         return {'Error': 'Unable to create user'}
     return user_get(data['id'], **connection_args)
@@ -505,8 +1031,9 @@ def user_delete(user_id=None, **connection_args):
     user = _get_user_by_id(git, user_id)
     if not user:
         return {'Error': 'Unable to find user with user_id {0}'.format(user_id)}
-    deleted = git.deleteuser(user_id)
-    if deleted:
+    deleted = _request(git, 'delete', 'users/{0}'.format(user_id))
+    _clear_user_index(git)
+    if deleted is not None:
         return {'user_id': user['id'], 'user_name': user['name'], 'deleted': True}
     return {'Error': 'Unable to delete user {0} (username: {1})'.format(user['id'], user['username'])}
 
@@ -530,21 +1057,27 @@ def user_update(user_id=None,
     '''
     git = auth(**connection_args)
     if not user_id:
-        user = _get_user_by_name(username)
-        user_id = user['id']
+        user = _get_user_by_name(git, username)
+        user_id = user and user['id']
     if not user_id:
         return {'Error': 'Unable to resolve user id'}
-    user = git.getuser(user_id)
+    user = _get_user_by_id(git, user_id)
+    if not user:
+        return {'Error': 'Unable to resolve user id'}
     if not name:
         name = user['name']
     if not username:
         username = user['username']
     if not email:
         email = user['email']
+    fields = {'name': name, 'username': username, 'email': email}
     if password:
-        user_edited = git.edituser(user_id, name=name, username=username, email=email, password=password)
-    else: 
-        user_edited = git.edituser(user_id, name=name, username=username, email=email)
+        fields['password'] = password
+    user_edited = _request(git, 'put', 'users/{0}'.format(user_id),
+                           data=fields)
+    _clear_user_index(git)
+    if not user_edited:
+        return {'Error': 'Unable to update user {0}'.format(user_id)}
     return user_edited
     
 def branch_create(project,
@@ -566,12 +1099,10 @@ def branch_create(project,
     project = _get_project_by_name(git, project)
     if not project:
         return {'Error': 'Error in retrieving project'}
-    data = git.createbranch(project['id'],
-                        branch=branch_name,
-                        ref=ref)
+    data = _create_branch(git, project, branch_name, ref)
     if not data:
         return {'Error': 'Unable to create branch {0}'.format(branch_name)}
-    return branch_get(data['name'], project_id=project['id'])
+    return branch_get(data['name'], project_id=project['id'], **connection_args)
 
 def branch_get(branch_name, project=None, project_id=None, **connection_args):
     '''
@@ -586,14 +1117,1211 @@ def branch_get(branch_name, project=None, project_id=None, **connection_args):
     '''
     git = auth(**connection_args)
     ret = {}
-    project = _get_project_by_name(git, project)
+    if project:
+        project = _get_project_by_name(git, project)
     if not project:
         project = _get_project_by_id(git, project_id)
     if not project:
         return {'Error': 'Error in retrieving project'}
-    data = git.getbranch(project['id'],
-                        branch_name)
+    data = _request(git, 'get', 'projects/{0}/repository/branches/{1}'.format(
+        project['id'], quote(branch_name, safe='')))
     if not data:
         return {'Error': 'Unable to locate branch {0}'.format(branch_name)}
     ret[branch_name] = data
     return ret
+
+
+def _parse_branches(branches, ref='master'):
+    '''
+    Normalise a list of branches into (branch, ref) pairs. Entries may be
+    plain branch names, which are created from ``ref``, or single-key
+    mappings of branch name to ref.
+    '''
+    ret = []
+    for branch in branches:
+        if isinstance(branch, dict):
+            ret.extend(branch.items())
+        else:
+            ret.append((branch, ref))
+    return ret
+
+
+def branch_list(project=None, project_id=None, **connection_args):
+    '''
+    Return a list of branches of a project
+
+    CLI Examples:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.branch_list my_project
+        salt '*' gitlab.branch_list project_id=341
+    '''
+    git = auth(**connection_args)
+    ret = {}
+    if project:
+        project = _get_project_by_name(git, project)
+    else:
+        project = _get_project_by_id(git, project_id)
+    if not project:
+        return {'Error': 'Error in retrieving project'}
+    for branch in _paginate(git, 'projects/{0}/repository/branches'.format(
+            project['id'])):
+        ret[branch.get('name')] = branch
+    return ret
+
+
+def branches_create(project=None, branches=None, ref='master',
+                    project_id=None, **connection_args):
+    '''
+    Create every missing branch of a project. The project is resolved and
+    its branches listed once, then only the missing branches are created,
+    in parallel up to ``gitlab.workers`` at a time.
+
+    Returns the outcome per branch.
+
+    CLI Examples:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.branches_create my_project '[staging, {release-1: v1.0}]'
+        salt '*' gitlab.branches_create project_id=341 branches='[staging]' ref=develop
+    '''
+    git = auth(**connection_args)
+    if project:
+        project = _get_project_by_name(git, project)
+    else:
+        project = _get_project_by_id(git, project_id)
+    if not project:
+        return {'Error': 'Error in retrieving project'}
+    return _ensure_branches(git, project, _parse_branches(branches or [], ref),
+                            _get_workers(git))
+
+
+def _create_branch(git, project, branch_name, ref):
+    # API v3 names the new branch branch_name, v4 branch
+    data = {'branch_name' if _api_v3(git) else 'branch': branch_name,
+            'ref': ref}
+    return _request(git, 'post', 'projects/{0}/repository/branches'.format(
+        project['id']), data=data)
+
+
+def _ensure_branches(git, project, branches, workers):
+    existing = set(branch.get('name') for branch in _paginate(
+        git, 'projects/{0}/repository/branches'.format(project['id'])))
+    ret = {}
+    missing = []
+    for branch_name, branch_ref in branches:
+        if branch_name in existing:
+            ret[branch_name] = {'ref': branch_ref, 'created': False}
+        else:
+            missing.append((branch_name, branch_ref))
+
+    def _create(branch):
+        branch_name, branch_ref = branch
+        data = _create_branch(git, project, branch_name, branch_ref)
+        if not data:
+            return {'Error': 'Unable to create branch {0}'.format(branch_name)}
+        return {'ref': branch_ref, 'created': True}
+
+    for branch, result in zip(missing, _parallel(_create, missing, workers)):
+        ret[branch[0]] = result
+    return ret
+
+
+def group_project_list(group, include_subgroups=False, **connection_args):
+    '''
+    Return a list of the projects of a group
+
+    CLI Examples:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.group_project_list mygroup
+        salt '*' gitlab.group_project_list mygroup/subgroup include_subgroups=True
+    '''
+    git = auth(**connection_args)
+    group = _get_group(git, group)
+    if not group:
+        return {'Error': 'Unable to resolve group'}
+    ret = {}
+    for project in _group_projects(git, group, include_subgroups):
+        ret[project.get('path_with_namespace')] = project
+    return ret
+
+
+def group_hook_create(group, hook_url, issues=False, merge_requests=False,
+                      push=False, tag_push=False, include_subgroups=False,
+                      **connection_args):
+    '''
+    Create an hook in every project of a group that lacks it
+
+    Returns the outcome per project.
+
+    CLI Examples:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.group_hook_create mygroup 'https://hook.url/' push=True
+    '''
+    git = auth(**connection_args)
+
+    def _create(project):
+        return _ensure_hook(git, project, hook_url, issues=issues, push=push,
+                            merge_requests=merge_requests, tag_push=tag_push)
+
+    return _group_apply(git, group, _create, include_subgroups,
+                        _get_workers(git))
+
+
+def group_deploykey_create(group, title, key, include_subgroups=False,
+                           **connection_args):
+    '''
+    Add a deploy key to every project of a group that lacks it
+
+    Returns the outcome per project.
+
+    CLI Examples:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.group_deploykey_create mygroup title keyfrsdfdsfds
+    '''
+    git = auth(**connection_args)
+
+    def _create(project):
+        return _ensure_deploykey(git, project, title, key)
+
+    return _group_apply(git, group, _create, include_subgroups,
+                        _get_workers(git))
+
+
+def group_branches_create(group, branches, ref='master',
+                          include_subgroups=False, **connection_args):
+    '''
+    Create the missing branches in every project of a group
+
+    Returns the outcome per project and branch.
+
+    CLI Examples:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.group_branches_create mygroup '[staging, {release-1: v1.0}]'
+    '''
+    git = auth(**connection_args)
+    branches = _parse_branches(branches, ref)
+
+    def _create(project):
+        return _ensure_branches(git, project, branches, 1)
+
+    return _group_apply(git, group, _create, include_subgroups,
+                        _get_workers(git))
+
+
+def _user_index(git):
+    '''
+    Return the users of this Gitlab instance indexed by username, listing
+    them only once per run
+    '''
+    key = 'gitlab.users.{0}'.format(git.salt_profile)
+    with _INDEX_LOCK:
+        if key not in __context__:
+            __context__[key] = dict((user.get('username'), user)
+                                    for user in _paginate(git, 'users'))
+    return __context__[key]
+
+
+def _clear_user_index(git):
+    __context__.pop('gitlab.users.{0}'.format(git.salt_profile), None)
+
+
+def users_sync(users, block_unmanaged=False, **connection_args):
+    '''
+    Bring the Gitlab users in line with a list of users, each a mapping
+    with username, name, email and, for creation, password.
+
+    Existing users are listed once and diffed on username, email and name,
+    then only the needed creates and updates are made, in parallel up to
+    ``gitlab.workers`` at a time. Passwords are only set on creation. With
+    block_unmanaged, active users that are not listed are blocked;
+    administrators and internal or bot users are never blocked.
+
+    Returns the action taken and the changed fields per user.
+
+    CLI Examples:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.users_sync "[{username: kevinquinnyo, name: 'Kevin Quinn', email: kevin@example.com, password: p4ssw0rd}]"
+    '''
+    git = auth(**connection_args)
+    existing = _user_index(git)
+    ret = {}
+    writes = []
+    for user in users:
+        username = user['username']
+        current = existing.get(username)
+        if not current:
+            missing = [field for field in ('name', 'email')
+                       if not user.get(field)]
+            if missing:
+                ret[username] = {'Error': 'Unable to create user {0}: '
+                                          'no {1}'.format(username,
+                                                          ', '.join(missing))}
+            else:
+                writes.append(('create', username, user))
+            continue
+        changes = {}
+        for field in ('name', 'email'):
+            if field in user and current.get(field) != user[field]:
+                changes[field] = user[field]
+        if changes:
+            writes.append(('update', username, changes))
+        else:
+            ret[username] = {'action': None, 'changes': {}}
+
+    if block_unmanaged:
+        managed = set(user['username'] for user in users)
+        for username, current in existing.items():
+            # Gitlab refuses to block its internal and bot users
+            if username in managed or current.get('is_admin') or \
+                    current.get('bot') or username == 'ghost':
+                continue
+            if current.get('state') != 'blocked':
+                writes.append(('block', username, {'state': 'blocked'}))
+
+    def _write(write):
+        action, username, fields = write
+        if action == 'create':
+            extra = dict((key, value) for key, value in fields.items()
+                         if key not in ('name', 'username', 'password', 'email'))
+            extra.update(name=fields['name'], username=username,
+                         password=fields.get('password'),
+                         email=fields['email'])
+            data = _request(git, 'post', 'users', data=extra)
+        elif action == 'update':
+            data = _request(git, 'put',
+                            'users/{0}'.format(existing[username]['id']),
+                            data=fields)
+        else:
+            # API v3 blocks with PUT, v4 with POST
+            data = _request(git, 'put' if _api_v3(git) else 'post',
+                            'users/{0}/block'.format(existing[username]['id']))
+        if data is None or (action != 'block' and not data):
+            return {'Error': 'Unable to {0} user {1}'.format(action, username)}
+        if isinstance(data, dict):
+            existing[username] = data
+        elif action == 'block':
+            existing[username]['state'] = 'blocked'
+        return {'action': {'create': 'created',
+                           'update': 'updated',
+                           'block': 'blocked'}[action],
+                'changes': dict((key, value) for key, value in fields.items()
+                                if key != 'password')}
+
+    results = _parallel(_write, writes, _get_workers(git))
+    for write, result in zip(writes, results):
+        ret[write[1]] = result
+    return ret
+
+
+def _access_level(level):
+    '''
+    Return the number of an access level given by name or number, or None
+    if there is no such level
+    '''
+    if level in ACCESS_LEVELS:
+        return ACCESS_LEVELS[level]
+    try:
+        level = int(level)
+    except (TypeError, ValueError):
+        return None
+    if level not in ACCESS_LEVELS.values():
+        return None
+    return level
+
+
+def _members_sync(git, kind, target, members, remove_unmanaged):
+    '''
+    Diff the members of one project or group against the desired access
+    levels and make the minimal changes
+    '''
+    _CALLS.count = 0
+    if kind == 'projects':
+        resolved = _get_project_by_name(git, target)
+    else:
+        resolved = _get_group(git, target)
+    if not resolved:
+        return {'Error': 'Unable to resolve {0} {1}'.format(kind[:-1], target)}
+    path = '{0}/{1}/members'.format(kind, resolved['id'])
+
+    current = dict((member.get('username'), member)
+                   for member in _paginate(git, path))
+    ret = {'added': [], 'updated': [], 'removed': [], 'errors': []}
+
+    writes = []
+    for username, name in members.items():
+        level = _access_level(name)
+        if level is None:
+            ret['errors'].append('Unknown access level {0} for user '
+                                 '{1}'.format(name, username))
+            continue
+        member = current.get(username)
+        if not member:
+            user = _user_index(git).get(username)
+            if not user:
+                ret['errors'].append('Unknown user {0}'.format(username))
+                continue
+            writes.append(('added', username, 'post', path,
+                           {'user_id': user['id'], 'access_level': level}))
+        elif member.get('access_level') != level:
+            writes.append(('updated', username, 'put',
+                           '{0}/{1}'.format(path, member['id']),
+                           {'access_level': level}))
+    if remove_unmanaged:
+        for username, member in current.items():
+            if username not in members:
+                writes.append(('removed', username, 'delete',
+                               '{0}/{1}'.format(path, member['id']), None))
+
+    for action, username, method, url, data in writes:
+        if _request(git, method, url, data=data) is None:
+            ret['errors'].append('Unable to change member {0}'.format(username))
+        else:
+            ret[action].append(username)
+    ret['api_calls'] = _CALLS.count
+    return ret
+
+
+def members_sync(members, projects=None, groups=None, remove_unmanaged=False,
+                 **connection_args):
+    '''
+    Bring the members of projects and/or groups in line with a mapping of
+    username to access level (a name such as developer, or its number).
+    Unknown users and access levels are reported as errors.
+
+    Each project or group lists its members once; only the needed add,
+    update and, with remove_unmanaged, remove calls are made. Several
+    projects and groups are handled in parallel up to ``gitlab.workers``
+    at a time.
+
+    Returns the added, updated and removed usernames and the number of
+    API calls made per project or group, including the listing of the
+    shared project and user indexes by whichever needed them first.
+
+    CLI Examples:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.members_sync '{kevinquinnyo: developer}' projects='[namespace/repository]'
+        salt '*' gitlab.members_sync '{kevinquinnyo: owner}' groups='[namespace]' remove_unmanaged=True
+    '''
+    git = auth(**connection_args)
+    targets = [('projects', target) for target in projects or []] + \
+              [('groups', target) for target in groups or []]
+
+    def _sync(target):
+        return _members_sync(git, target[0], target[1], members,
+                             remove_unmanaged)
+
+    return dict((target[1], result) for target, result in
+                zip(targets, _parallel(_sync, targets,
+                                       _get_workers(git))))
+
+
+async def _async_get_all(session, semaphore, limiter, api_url, path,
+                         per_page=100):
+    '''
+    Return every item of a paginated API listing, holding the semaphore
+    only while a page is being fetched. Like _paginate, a failed page
+    raises.
+    '''
+    import asyncio
+    items = []
+    page = 1
+    while page:
+        async with semaphore:
+            await asyncio.sleep(limiter.reserve())
+            async with session.get('{0}/{1}'.format(api_url, path),
+                                   params={'page': page,
+                                           'per_page': per_page}) as resp:
+                if resp.status >= 400:
+                    raise CommandExecutionError(
+                        'Unable to list {0} (page {1}): HTTP {2}'.format(
+                            path, page, resp.status))
+                items.extend(await resp.json())
+                page = resp.headers.get('X-Next-Page')
+    return items
+
+
+async def _async_list_all(git, projects, endpoint, concurrency):
+    '''
+    Fetch an endpoint of many projects concurrently over one pooled
+    session
+    '''
+    import asyncio
+    import aiohttp
+    semaphore = asyncio.Semaphore(concurrency)
+    auth = getattr(git, 'auth', None)
+    timeout = getattr(git, 'timeout', None)
+    session = aiohttp.ClientSession(
+        headers=_headers(git),
+        auth=aiohttp.BasicAuth(*auth) if auth else None,
+        timeout=aiohttp.ClientTimeout(total=timeout) if timeout else None,
+        connector=aiohttp.TCPConnector(
+            limit=concurrency,
+            ssl=None if getattr(git, 'verify_ssl', True) else False))
+    async with session:
+        return await asyncio.gather(*[
+            _async_get_all(session, semaphore, git.salt_limiter, git.api_url,
+                           'projects/{0}/{1}'.format(project['id'], endpoint))
+            for project in projects])
+
+
+def _list_all(endpoint, key, projects=None, group=None,
+              include_subgroups=False, backend=None, **connection_args):
+    '''
+    Return an endpoint of many projects, by project path then key
+    '''
+    git = auth(**connection_args)
+    if group:
+        group = _get_group(git, group)
+        if not group:
+            return {'Error': 'Unable to resolve group'}
+        projects = list(_group_projects(git, group, include_subgroups))
+    elif projects:
+        index = _project_index(git)
+        missing = [name for name in projects if name.lstrip('/') not in index]
+        if missing:
+            return {'Error': 'Unable to resolve projects {0}'.format(
+                ', '.join(missing))}
+        projects = [index[name.lstrip('/')] for name in projects]
+    else:
+        projects = list(_project_index(git).values())
+
+    if backend is None:
+        backend = git.salt_config['bulk_backend']
+    if backend == 'asyncio' and HAS_AIOHTTP:
+        import asyncio
+        concurrency = git.salt_config['concurrency']
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(
+                _async_list_all(git, projects, endpoint, concurrency))
+        finally:
+            loop.close()
+    else:
+        def _list(project):
+            return list(_paginate(git, 'projects/{0}/{1}'.format(
+                project['id'], endpoint)))
+        results = _parallel(_list, projects, _get_workers(git))
+
+    ret = {}
+    for project, items in zip(projects, results):
+        ret[project.get('path_with_namespace')] = dict(
+            (item.get(key), item) for item in items)
+    return ret
+
+
+def hook_list_all(projects=None, group=None, include_subgroups=False,
+                  backend=None, **connection_args):
+    '''
+    Return the hooks of many projects: the given project paths, the
+    projects of a group, or else every project. Uses the asyncio backend
+    when ``gitlab.bulk_backend`` (or backend) is asyncio and aiohttp is
+    installed, and the worker pool otherwise; both give the same result.
+
+    CLI Examples:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.hook_list_all
+        salt '*' gitlab.hook_list_all group=namespace include_subgroups=True
+        salt '*' gitlab.hook_list_all projects='[namespace/repository]' backend=asyncio
+    '''
+    return _list_all('hooks', 'url', projects=projects, group=group,
+                     include_subgroups=include_subgroups, backend=backend,
+                     **connection_args)
+
+
+def deploykey_list_all(projects=None, group=None, include_subgroups=False,
+                       backend=None, **connection_args):
+    '''
+    Return the deploy keys of many projects: the given project paths, the
+    projects of a group, or else every project. Uses the asyncio backend
+    when ``gitlab.bulk_backend`` (or backend) is asyncio and aiohttp is
+    installed, and the worker pool otherwise; both give the same result.
+
+    CLI Examples:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.deploykey_list_all
+        salt '*' gitlab.deploykey_list_all group=namespace backend=asyncio
+    '''
+    return _list_all('keys', 'title', projects=projects, group=group,
+                     include_subgroups=include_subgroups, backend=backend,
+                     **connection_args)
+
+
+# Order in which queued writes are flushed: projects are created and
+# updated before their hooks and keys are written, and deleted last
+WRITE_STAGES = (('project', ('create', 'replace')),
+                ('project', ('update',)),
+                ('hook', ('create', 'replace', 'delete')),
+                ('deploykey', ('create', 'replace', 'delete')),
+                ('project', ('delete',)))
+
+_QUEUE_LOCK = threading.Lock()
+
+
+def _queue_enabled(git, queue=None):
+    if queue is None:
+        return git.salt_config['write_queue']
+    return queue
+
+
+def _write_queue(git):
+    return __context__.setdefault(
+        'gitlab.write_queue.{0}'.format(git.salt_profile), {})
+
+
+def _merge_write(queued, action, data):
+    '''
+    Merge a write into the write already queued for the same object. A
+    delete always wins, as a queued create does not mean the object was
+    missing; deleting an object that is gone is a no-op at flush.
+    '''
+    previous = queued['action']
+    if action == 'delete':
+        return dict(queued, action='delete', data={})
+    if previous == 'delete':
+        if action == 'update':
+            return queued
+        return dict(queued, action='replace', data=dict(data))
+    merged = dict(queued['data'], **data)
+    if previous == 'update':
+        return dict(queued, action=action, data=merged)
+    return dict(queued, data=merged)
+
+
+def _enqueue(git, kind, project, ident, action, data=None):
+    '''
+    Record a write to make at the next flush, merged with the writes
+    already queued for the same object
+    '''
+    project = project.lstrip('/')
+    key = '{0}:{1}:{2}'.format(kind, project, ident).rstrip(':')
+    write = {'kind': kind, 'project': project, 'ident': ident,
+             'action': action, 'data': dict(data or {})}
+    queue = _write_queue(git)
+    with _QUEUE_LOCK:
+        if key in queue:
+            write = _merge_write(queue[key], action, write['data'])
+        queue[key] = write
+    return {'Queued': key}
+
+
+def _wait_deleted(git, project_id, timeout=60, interval=1, max_interval=10):
+    '''
+    Wait for a deleted project to be gone, as Gitlab may remove it in the
+    background. Return whether it is gone.
+    '''
+    deadline = time.time() + timeout
+    while True:
+        if _response(git, 'get',
+                     'projects/{0}'.format(project_id)).status_code == 404:
+            return True
+        if time.time() + interval > deadline:
+            return False
+        time.sleep(interval)
+        interval = min(interval * 2, max_interval)
+
+
+def _flush_write(git, write, namespaces=None):
+    '''
+    Make one queued write, given the ids of the namespaces of the projects
+    to create. Return its outcome.
+    '''
+    kind, action, data = write['kind'], write['action'], write['data']
+    project = _get_project_by_name(git, write['project'])
+    if kind == 'project' and action in ('create', 'replace'):
+        if project and action == 'replace':
+            if _request(git, 'delete',
+                        'projects/{0}'.format(project['id'])) is None:
+                return {'Error': 'Unable to delete project'}
+            # The path stays taken until the old project is gone
+            if not _wait_deleted(git, project['id']):
+                return {'Error': 'Project {0} is still being deleted'.format(
+                    write['project'])}
+        elif project:
+            return {'action': None}
+        namespace, _, path = write['project'].rpartition('/')
+        data = dict(data, name=path, path=path)
+        if namespace:
+            data['namespace_id'] = namespaces[namespace]
+        if not _request(git, 'post', 'projects', data=data):
+            return {'Error': 'Unable to create project'}
+        return {'action': 'created'}
+    if not project and kind == 'project' and action == 'delete':
+        return {'action': None}
+    if not project:
+        return {'Error': 'Unable to resolve project'}
+
+    if kind == 'project' and action == 'update':
+        changes = dict((field, value) for field, value in data.items()
+                       if project.get(field) != value)
+        if not changes:
+            return {'action': None}
+        if not _request(git, 'put', 'projects/{0}'.format(project['id']),
+                        data=changes):
+            return {'Error': 'Unable to update project'}
+        return {'action': 'updated', 'changes': changes}
+    if kind == 'project':
+        if _request(git, 'delete',
+                    'projects/{0}'.format(project['id'])) is None:
+            return {'Error': 'Unable to delete project'}
+        return {'action': 'deleted'}
+
+    if kind == 'hook':
+        path = 'projects/{0}/hooks'.format(project['id'])
+        current = [hook for hook in _paginate(git, path)
+                   if hook.get('url') == write['ident']]
+    else:
+        path = 'projects/{0}/keys'.format(project['id'])
+        current = [key for key in _paginate(git, path)
+                   if key.get('title') == write['ident']]
+    if action in ('delete', 'replace'):
+        for item in current:
+            if _request(git, 'delete',
+                        '{0}/{1}'.format(path, item['id'])) is None:
+                return {'Error': 'Unable to delete {0}'.format(write['ident'])}
+        if action == 'delete':
+            return {'action': 'deleted' if current else None}
+    elif current:
+        return {'action': None}
+    if kind == 'hook':
+        result = _ensure_hook(git, project, write['ident'], **data)
+    else:
+        result = _ensure_deploykey(git, project, write['ident'], data['key'])
+    if 'Error' in result:
+        return result
+    return {'action': 'created'}
+
+
+def flush(**connection_args):
+    '''
+    Make the writes queued during this run. Writes to the same object
+    have been merged into one, which is made in dependency order (projects, then their hooks and deploy keys,
+    then project deletions), each stage in parallel up to
+    ``gitlab.workers`` at a time. Writes that turn out to change nothing
+    are skipped.
+
+    Returns the outcome per queued object, under the key returned when
+    the write was queued.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.flush
+    '''
+    git = auth(**connection_args)
+    queue = _write_queue(git)
+    with _QUEUE_LOCK:
+        writes = list(queue.items())
+        queue.clear()
+
+    ret = {}
+    for kind, actions in WRITE_STAGES:
+        stage = [(key, write) for key, write in writes
+                 if write['kind'] == kind and write['action'] in actions]
+        if not stage:
+            continue
+        # Build the project index once, before the workers need it
+        _project_index(git)
+        namespaces = {}
+        if kind == 'project' and 'create' in actions:
+            # Resolve the namespaces up front, so no two workers race to
+            # create the same group
+            namespaces = _ensure_namespaces(
+                git, set(write['project'].rpartition('/')[0]
+                         for _, write in stage if '/' in write['project']),
+                _get_workers(git))
+            if 'Error' in namespaces:
+                ret.update((key, namespaces) for key, _ in stage)
+                continue
+
+        def _flush(item):
+            return _flush_write(git, item[1], namespaces)
+
+        for item, result in zip(stage, _parallel(_flush, stage,
+                                                 _get_workers(git))):
+            ret[item[0]] = result
+        if kind == 'project':
+            _clear_project_index(git)
+    return ret
+
+
+def _ensure_namespaces(git, paths, workers):
+    '''
+    Resolve namespaces by path, creating the missing ones as groups,
+    parents first. Return the namespace ids by path, or an error.
+    '''
+    if _api_v3(git):
+        # API v3 has no subgroups, and would create them at the top level
+        nested = sorted(path for path in paths if '/' in path)
+        if nested:
+            return {'Error': 'Nested namespaces need Gitlab API v4 '
+                             '(gitlab.api_version: 4): {0}'.format(
+                                 ', '.join(nested))}
+    wanted = set()
+    for path in paths:
+        parts = path.split('/')
+        wanted.update('/'.join(parts[:depth])
+                      for depth in range(1, len(parts) + 1))
+    wanted = sorted(wanted)
+
+    def _resolve(path):
+        # API v3 cannot get a namespace by path, so search by its last
+        # component. Only API versions with subgroups return full_path.
+        for namespace in _paginate(git, 'namespaces',
+                                   search=path.rpartition('/')[2]):
+            if namespace.get('full_path', namespace.get('path')) == path:
+                return namespace
+        return None
+
+    ret = {}
+    for path, namespace in zip(wanted, _parallel(_resolve, wanted, workers)):
+        if namespace:
+            ret[path] = namespace['id']
+
+    # Create each level of missing groups in parallel once its parents exist
+    missing = [path for path in wanted if path not in ret]
+    for depth in sorted(set(path.count('/') for path in missing)):
+        level = [path for path in missing if path.count('/') == depth]
+
+        def _create(path):
+            parent, _, leaf = path.rpartition('/')
+            data = {'name': leaf, 'path': leaf}
+            if parent:
+                data['parent_id'] = ret[parent]
+            return _request(git, 'post', 'groups', data=data)
+
+        for path, group in zip(level, _parallel(_create, level, workers)):
+            if not group:
+                return {'Error': 'Unable to create namespace {0}'.format(path)}
+            ret[path] = group['id']
+    return ret
+
+
+def projects_create(names, description=None, **connection_args):
+    '''
+    Create every missing project of a list of project paths. All paths are
+    resolved in one pass, then the missing namespaces (as groups) and
+    projects are created in parallel up to ``gitlab.workers`` at a time.
+
+    Returns the outcome per project.
+
+    CLI Examples:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.projects_create '[namespace1/repository1, namespace2/repository1]'
+    '''
+    git = auth(**connection_args)
+    workers = _get_workers(git)
+    index = _project_index(git)
+    ret = {}
+    missing = []
+    for name in names:
+        name = name.lstrip('/')
+        if name in index:
+            ret[name] = {'created': False, 'id': index[name]['id']}
+        else:
+            missing.append(name)
+    if not missing:
+        return ret
+
+    namespaces = _ensure_namespaces(
+        git, set(name.rpartition('/')[0] for name in missing if '/' in name),
+        workers)
+    if 'Error' in namespaces:
+        ret.update((name, namespaces) for name in missing)
+        return ret
+
+    def _create(name):
+        namespace, _, path = name.rpartition('/')
+        data = {'name': path, 'path': path, 'description': description}
+        if namespace:
+            data['namespace_id'] = namespaces[namespace]
+        data = _request(git, 'post', 'projects', data=data)
+        if not data:
+            return {'Error': 'Unable to create project {0}'.format(name)}
+        index[name] = data
+        return {'created': True, 'id': data['id']}
+
+    ret.update(zip(missing, _parallel(_create, missing, workers)))
+    return ret
+
+
+def projects_delete(names, **connection_args):
+    '''
+    Delete every existing project of a list of project paths. All paths
+    are resolved in one pass, then the projects are deleted by id in
+    parallel up to ``gitlab.workers`` at a time.
+
+    Returns the outcome per project.
+
+    CLI Examples:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.projects_delete '[namespace1/repository1, namespace2/repository1]'
+    '''
+    git = auth(**connection_args)
+    index = _project_index(git)
+    ret = {}
+    present = []
+    for name in names:
+        name = name.lstrip('/')
+        if name in index:
+            present.append(name)
+        else:
+            ret[name] = {'deleted': False}
+
+    def _delete(name):
+        if _request(git, 'delete',
+                    'projects/{0}'.format(index[name]['id'])) is None:
+            return {'Error': 'Unable to delete project {0}'.format(name)}
+        return {'deleted': True}
+
+    results = _parallel(_delete, present, _get_workers(git))
+    for name, result in zip(present, results):
+        if 'Error' not in result:
+            del index[name]
+        ret[name] = result
+    return ret
+
+
+def _jobs(git):
+    return __context__.setdefault(
+        'gitlab.jobs.{0}'.format(git.salt_profile), {})
+
+
+def _submitted(git, kind, name, project_id):
+    '''
+    Return the handle of a submitted job, and remember it so a later
+    wait without handles covers it
+    '''
+    job = {'id': '{0}:{1}'.format(kind, name),
+           'kind': kind,
+           'name': name,
+           'project_id': project_id}
+    _jobs(git)[job['id']] = job
+    return job
+
+
+def project_import_submit(name, import_url, description=None,
+                          **connection_args):
+    '''
+    Start creating a project by importing it from import_url, and return
+    a job handle without waiting for the import to finish
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.project_import_submit namespace/repository https://github.com/org/repository.git
+    '''
+    git = auth(**connection_args)
+    namespace, _, path = name.lstrip('/').rpartition('/')
+    data = {'name': path, 'path': path, 'import_url': import_url}
+    if namespace:
+        namespaces = _ensure_namespaces(git, [namespace], _get_workers(git))
+        if 'Error' in namespaces:
+            return namespaces
+        data['namespace_id'] = namespaces[namespace]
+    if description is not None:
+        data['description'] = description
+    project = _request(git, 'post', 'projects', data=data)
+    if not project:
+        return {'Error': 'Unable to create project {0}'.format(name)}
+    _clear_project_index(git)
+    return _submitted(git, 'import', name.lstrip('/'), project['id'])
+
+
+def project_delete_submit(name, **connection_args):
+    '''
+    Start deleting a project, and return a job handle without waiting for
+    the deletion to finish
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.project_delete_submit namespace/repository
+    '''
+    git = auth(**connection_args)
+    project = _get_project_by_name(git, name)
+    if not project:
+        return {'Error': 'Unable to resolve project id'}
+    if _request(git, 'delete', 'projects/{0}'.format(project['id'])) is None:
+        return {'Error': 'Unable to delete project {0}'.format(name)}
+    _drop_from_project_index(git, project['id'])
+    return _submitted(git, 'delete', name.lstrip('/'), project['id'])
+
+
+def project_mirror_submit(name, **connection_args):
+    '''
+    Start pulling a mirrored project from its upstream, and return a job
+    handle without waiting for the update to finish. Needs API v4.
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.project_mirror_submit namespace/repository
+    '''
+    git = auth(**connection_args)
+    if _api_v3(git):
+        return {'Error': 'Updating mirrors needs Gitlab API v4 '
+                         '(gitlab.api_version: 4)'}
+    project = _get_project_by_name(git, name)
+    if not project:
+        return {'Error': 'Unable to resolve project id'}
+    if _request(git, 'post',
+                'projects/{0}/mirror/pull'.format(project['id'])) is None:
+        return {'Error': 'Unable to update mirror of project {0}'.format(name)}
+    return _submitted(git, 'mirror', name.lstrip('/'), project['id'])
+
+
+def _job_status(git, job):
+    '''
+    Poll a job once. Return its state: running, finished or failed.
+    Other errors than a missing project are taken as transient.
+    '''
+    path = 'projects/{0}'.format(job['project_id'])
+    # API v3 reports the import status with the project
+    if job['kind'] != 'delete' and not _api_v3(git):
+        path += '/import'
+    resp = _response(git, 'get', path)
+    if job['kind'] == 'delete':
+        if resp.status_code == 404:
+            return {'state': 'finished'}
+        project = resp.json() if resp.ok else {}
+        if project.get('marked_for_deletion_at') or \
+                project.get('marked_for_deletion_on'):
+            return {'state': 'finished'}
+        return {'state': 'running'}
+    if resp.status_code == 404:
+        return {'state': 'failed',
+                'Error': 'Project {0} no longer exists'.format(
+                    job['project_id'])}
+    if not resp.ok:
+        return {'state': 'running'}
+    status = resp.json()
+    if status.get('import_status') == 'finished':
+        return {'state': 'finished'}
+    if status.get('import_status') == 'failed':
+        return {'state': 'failed', 'Error': status.get('import_error')}
+    return {'state': 'running'}
+
+
+def job_status(job, **connection_args):
+    '''
+    Return the state of a job handle: running, finished or failed
+
+    CLI Example:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.job_status "{kind: import, project_id: 341, id: 'import:namespace/repository'}"
+    '''
+    git = auth(**connection_args)
+    return _job_status(git, job)
+
+
+def wait(jobs=None, timeout=600, interval=1, max_interval=30,
+         **connection_args):
+    '''
+    Wait for jobs to finish, by default every job submitted in this run.
+    All unfinished jobs are polled together, in parallel up to
+    ``gitlab.workers`` at a time, with the poll interval doubling up to
+    max_interval while any of them is still running.
+
+    Returns the final state per job; jobs still running at timeout are
+    reported as such.
+
+    CLI Examples:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.wait
+        salt '*' gitlab.wait timeout=1800 max_interval=60
+    '''
+    git = auth(**connection_args)
+    registry = _jobs(git)
+    if jobs is None:
+        jobs = list(registry.values())
+    pending = dict((job['id'], job) for job in jobs)
+    ret = {}
+    deadline = time.time() + timeout
+
+    def _poll(job):
+        return _job_status(git, job)
+
+    while pending:
+        polled = list(pending.values())
+        for job, status in zip(polled, _parallel(_poll, polled,
+                                                 _get_workers(git))):
+            if status['state'] != 'running':
+                ret[job['id']] = status
+                del pending[job['id']]
+                registry.pop(job['id'], None)
+        if not pending or time.time() + interval > deadline:
+            break
+        time.sleep(interval)
+        interval = min(interval * 2, max_interval)
+
+    for job_id in pending:
+        ret[job_id] = {'state': 'running'}
+    return ret
+
+
+def branch_list_all(projects=None, group=None, include_subgroups=False,
+                    backend=None, **connection_args):
+    '''
+    Return the branches of many projects: the given project paths, the
+    projects of a group, or else every project. Uses the same backends as
+    ``gitlab.hook_list_all``.
+
+    CLI Examples:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.branch_list_all group=namespace
+    '''
+    return _list_all('repository/branches', 'name', projects=projects,
+                     group=group, include_subgroups=include_subgroups,
+                     backend=backend, **connection_args)
+
+
+def _drift_items(git, desired, **connection_args):
+    '''
+    Diff the desired configuration against the instance. Return the
+    drifted items by id.
+    '''
+    ret = {}
+    projects = dict((path.lstrip('/'), wanted or {}) for path, wanted in
+                    (desired.get('projects') or {}).items())
+    index = _project_index(git)
+    present = []
+    for path, wanted in projects.items():
+        project = index.get(path)
+        if not project:
+            ret['project:{0}'.format(path)] = {'drift': 'missing'}
+            continue
+        present.append(path)
+        if 'description' in wanted and \
+                project.get('description') != wanted['description']:
+            ret['project:{0}'.format(path)] = {
+                'drift': 'changed',
+                'description': project.get('description')}
+
+    def _wanted(field):
+        return [path for path in present if projects[path].get(field)]
+
+    # Only list what the desired configuration refers to
+    listings = (('hook', 'hooks', hook_list_all,
+                 lambda items: dict((url, None) for url in items)),
+                ('deploykey', 'deploykeys', deploykey_list_all, dict),
+                ('branch', 'branches', branch_list_all,
+                 lambda items: dict(_parse_branches(items))))
+    for kind, field, list_all, parse in listings:
+        paths = _wanted(field)
+        if not paths:
+            continue
+        actual = list_all(projects=paths, **connection_args)
+        if 'Error' in actual:
+            return actual
+        for path in paths:
+            for ident, value in parse(projects[path][field]).items():
+                current = actual.get(path, {}).get(ident)
+                if current is None:
+                    ret['{0}:{1}:{2}'.format(kind, path, ident)] = \
+                        {'drift': 'missing'}
+                elif kind == 'deploykey' and \
+                        (current.get('key') or '').strip() != value.strip():
+                    ret['{0}:{1}:{2}'.format(kind, path, ident)] = \
+                        {'drift': 'changed', 'key': current.get('key')}
+
+    users = _user_index(git) if desired.get('users') else {}
+    for user in desired.get('users') or []:
+        current = users.get(user['username'])
+        if not current:
+            ret['user:{0}'.format(user['username'])] = {'drift': 'missing'}
+            continue
+        changed = dict((field, current.get(field))
+                       for field in ('name', 'email')
+                       if field in user and current.get(field) != user[field])
+        if changed:
+            changed['drift'] = 'changed'
+            ret['user:{0}'.format(user['username'])] = changed
+    return ret
+
+
+def drift(pillar_key='gitlab', events=True, refresh=True, **connection_args):
+    '''
+    Compare the desired projects, hooks, deploy keys, branches and users
+    kept in pillar under pillar_key with the instance, without writing to
+    it. The instance is read through bulk listings only, once per check
+    (or from this run's cache with refresh=False), and diffed in memory.
+
+    The report is kept between checks, and with events a Salt event is
+    fired for each item that drifted (tag gitlab/drift/new) or was
+    resolved (tag gitlab/drift/resolved) since the previous check.
+
+    Returns the drifted items, and the ids of those that are new or
+    resolved since the previous check.
+
+    CLI Examples:
+
+    .. code-block:: bash
+
+        salt '*' gitlab.drift
+        salt '*' gitlab.drift pillar_key=gitlab_dr profile=gitlab_dr events=False
+    '''
+    git = auth(**connection_args)
+    desired = __salt__['pillar.get'](pillar_key, {})
+    if refresh:
+        _clear_project_index(git)
+        _clear_user_index(git)
+
+    items = _drift_items(git, desired, **connection_args)
+    if 'Error' in items:
+        return items
+
+    cache = os.path.join(__opts__['cachedir'], 'gitlab',
+                         'drift.{0}.json'.format(quote(git.salt_profile,
+                                                       safe='')))
+    previous = {}
+    if os.path.isfile(cache):
+        with open(cache) as fp_:
+            previous = json.load(fp_)
+    if not os.path.isdir(os.path.dirname(cache)):
+        os.makedirs(os.path.dirname(cache))
+    with open(cache, 'w') as fp_:
+        json.dump(items, fp_)
+
+    new = sorted(ident for ident, item in items.items()
+                 if previous.get(ident) != item)
+    resolved = sorted(ident for ident in previous if ident not in items)
+    if events:
+        for ident in new:
+            __salt__['event.send']('gitlab/drift/new',
+                                   dict(items[ident], id=ident))
+        for ident in resolved:
+            __salt__['event.send']('gitlab/drift/resolved', {'id': ident})
+    return {'drift': items, 'new': new, 'resolved': resolved}
@@ -15,19 +15,86 @@ Management of Gitlab projects
           - namespace1/repository2
           - namespace2/repository1
 
+    Many Gitlab projects at once:
+      gitlab.projects_present:
+        - names:
+          - namespace1/repository1
+          - namespace1/repository2
+
     jenkins:
       gitlab.hook_present:
         - name: http://url_of_hook
         - project: 'namespace/repository'
 
+    release branches:
+      gitlab.branches_present:
+        - name: 'namespace/repository'
+        - branches:
+          - staging
+          - release-1: v1.0
+
     some_deploy_key:
       gitlab.deploykey_present:
         - name: title_of_key
         - key: public_key
         - project: 'namespace/repository'
 
+    Gitlab users:
+      gitlab.users_managed:
+        - users: {{ salt['pillar.get']('gitlab:users', []) | json }}
+        - block_unmanaged: True
+
+    jenkins for the whole group:
+      gitlab.group_hook_present:
+        - name: http://url_of_hook
+        - group: 'namespace'
+        - include_subgroups: True
+
+With ``gitlab.write_queue`` enabled, project, hook and deploy key writes
+are queued and made together by a final ``gitlab.flushed`` state:
+
+.. code-block:: yaml
+
+    gitlab writes:
+      gitlab.flushed:
+        - order: last
+
+Slow imports are started by ``gitlab.project_imported`` and awaited
+together by a later ``gitlab.jobs_finished`` state:
+
+.. code-block:: yaml
+
+    mirror of upstream:
+      gitlab.project_imported:
+        - name: 'namespace/repository'
+        - import_url: 'https://github.com/org/repository.git'
+
+    gitlab jobs:
+      gitlab.jobs_finished:
+        - timeout: 1800
+        - order: last
+
+Every state takes a ``profile`` naming the Gitlab instance to manage (see
+:py:mod:`salt.modules.gitlab`), or a list of profiles to apply the state to
+several instances concurrently:
+
+.. code-block:: yaml
+
+    jenkins everywhere:
+      gitlab.hook_present:
+        - name: http://url_of_hook
+        - project: 'namespace/repository'
+        - profile:
+          - gitlab_prod
+          - gitlab_dr
+
 '''
 
+from __future__ import absolute_import
+
+# Import python libs
+import functools
+
 
 def __virtual__():
     '''
@@ -36,6 +103,57 @@ def __virtual__():
     return 'gitlab' if 'gitlab.auth' in __salt__ else False
 
 
+def _profiles(func):
+    '''
+    Run the state against each profile concurrently when given a list of
+    profiles, and merge the results per profile
+    '''
+    argnames = func.__code__.co_varnames[:func.__code__.co_argcount]
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        kwargs.update(zip(argnames, args))
+        profiles = kwargs.get('profile')
+        if not isinstance(profiles, (list, tuple)):
+            return func(**kwargs)
+
+        def _run(profile):
+            return func(**dict(kwargs, profile=profile))
+
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(max(1, len(profiles)))
+        try:
+            results = pool.map(_run, profiles)
+        finally:
+            pool.close()
+            pool.join()
+
+        ret = {'name': results[0]['name'] if results else kwargs.get('name'),
+               'changes': {},
+               'result': True,
+               'comment': ''}
+        comments = []
+        for profile, result in zip(profiles, results):
+            if result['changes']:
+                ret['changes'][profile] = result['changes']
+            if not result['result']:
+                ret['result'] = False
+            comments.append('{0}: {1}'.format(profile, result['comment']))
+        ret['comment'] = '\n'.join(comments)
+        return ret
+    return wrapper
+
+
+def _queued(comment, result):
+    '''
+    Note in the comment when the write was only queued for gitlab.flush
+    '''
+    if isinstance(result, dict) and 'Queued' in result:
+        return '{0} (queued as {1})'.format(comment, result['Queued'])
+    return comment
+
+
+@_profiles
 def project_present(name, description=None, enabled=True, profile=None,
                    **connection_args):
     ''''
@@ -48,7 +166,8 @@ def project_present(name, description=None, enabled=True, profile=None,
         The description to use for this project
 
     enabled
-        Availability state for this project
+        Ignored, as Gitlab projects cannot be disabled. Kept for
+        compatibility with existing states.
     '''
     ret = {'name': name,
            'changes': {},
@@ -61,32 +180,38 @@ def project_present(name, description=None, enabled=True, profile=None,
                                              **connection_args)
 
     if 'Error' not in project:
-        if project[name]['description'] != description:
-            __salt__['gitlab.project_update'](name, description,
-                                               enabled,
-                                               profile=profile,
-                                               **connection_args)
-            comment = 'Tenant "{0}" has been updated'.format(name)
-            ret['comment'] = comment
+        project = list(project.values())[0]
+        if (description is not None and
+                project.get('description') != description):
             ret['changes']['Description'] = 'Updated'
-        if project[name]['enabled'] != enabled:
-            __salt__['gitlab.project_update'](name, description,
-                                               enabled,
-                                               profile=profile,
-                                               **connection_args)
-            comment = 'Tenant "{0}" has been updated'.format(name)
-            ret['comment'] = comment
-            ret['changes']['Enabled'] = 'Now {0}'.format(enabled)
+        if ret['changes']:
+            update = __salt__['gitlab.project_update'](name=name,
+                                                       description=description,
+                                                       profile=profile,
+                                                       **connection_args)
+            if 'Error' in update:
+                ret['changes'] = {}
+                ret['result'] = False
+                ret['comment'] = update['Error']
+                return ret
+            ret['comment'] = _queued('Tenant "{0}" has been updated'.format(name),
+                                     update)
     else:
         # Create project
-        __salt__['gitlab.project_create'](name, description, enabled,
-                                           profile=profile,
-                                           **connection_args)
-        ret['comment'] = 'Tenant "{0}" has been added'.format(name)
+        create = __salt__['gitlab.project_create'](name, description,
+                                                    profile=profile,
+                                                    **connection_args)
+        if 'Error' in create:
+            ret['result'] = False
+            ret['comment'] = create['Error']
+            return ret
+        ret['comment'] = _queued('Tenant "{0}" has been added'.format(name),
+                                 create)
         ret['changes']['Tenant'] = 'Created'
     return ret
 
 
+@_profiles
 def project_absent(name, profile=None, **connection_args):
     '''
     Ensure that the gitlab project is absent.
@@ -113,6 +238,69 @@ def project_absent(name, profile=None, **connection_args):
     return ret
 
 
+def _projects_ret(ret, results, key, change):
+    failed = []
+    for project, result in sorted(results.items()):
+        if 'Error' in result:
+            failed.append(result['Error'])
+        elif result[key]:
+            ret['changes'][project] = change
+    if failed:
+        ret['result'] = False
+        ret['comment'] = '; '.join(failed)
+    elif ret['changes']:
+        ret['comment'] = '{0} projects have been {1}'.format(
+            len(ret['changes']), change.lower())
+    return ret
+
+
+@_profiles
+def projects_present(name, names, description=None, **connection_args):
+    '''
+    Ensures that many gitlab projects exist, creating the missing ones and
+    their namespaces in parallel
+
+    name
+        An identifier for this set of projects
+
+    names
+        list of paths to projects, i.e. namespace/repo-name
+
+    description
+        The description to use for created projects
+    '''
+    ret = {'name': name,
+           'changes': {},
+           'result': True,
+           'comment': 'All projects already exist'}
+
+    results = __salt__['gitlab.projects_create'](names,
+                                                 description=description,
+                                                 **connection_args)
+    return _projects_ret(ret, results, 'created', 'Created')
+
+
+@_profiles
+def projects_absent(name, names, **connection_args):
+    '''
+    Ensure that many gitlab projects are absent, deleting them in parallel
+
+    name
+        An identifier for this set of projects
+
+    names
+        list of paths to projects that should not exist
+    '''
+    ret = {'name': name,
+           'changes': {},
+           'result': True,
+           'comment': 'All projects are already absent'}
+
+    results = __salt__['gitlab.projects_delete'](names, **connection_args)
+    return _projects_ret(ret, results, 'deleted', 'Deleted')
+
+
+@_profiles
 def deploykey_present(name, key, project, **connection_args):
     '''
     Ensure deploy key present in Gitlab project
@@ -138,7 +326,7 @@ def deploykey_present(name, key, project, **connection_args):
                                            **connection_args)
     if key.startswith('/'):
         keyfile = key
-        with file(keyfile) as f:
+        with open(keyfile) as f:
             key = f.read()
         f.close()
 
@@ -149,11 +337,13 @@ def deploykey_present(name, key, project, **connection_args):
         dkey = __salt__['gitlab.deploykey_create'](name, key,
                                                   project_name=project,
                                                   **connection_args)
-        ret['comment'] = 'Deploy key "{0}" has been added'.format(name)
+        ret['comment'] = _queued('Deploy key "{0}" has been added'.format(name),
+                                 dkey)
         ret['changes']['Deploykey'] = 'Created'
     return ret
 
 
+@_profiles
 def deploykey_absent(name, profile=None, **connection_args):
     '''
     Ensure that the deploy key doesn't exist in Gitlab project
@@ -181,6 +371,7 @@ def deploykey_absent(name, profile=None, **connection_args):
     return ret
 
 
+@_profiles
 def hook_present(name, project, **connection_args):
     '''
     Ensure hook present in Gitlab project
@@ -209,11 +400,13 @@ def hook_present(name, project, **connection_args):
         hook = __salt__['gitlab.hook_create'](name,
                                               project_name=project,
                                               **connection_args)
-        ret['comment'] = 'Hook "{0}" has been added'.format(name)
+        ret['comment'] = _queued('Hook "{0}" has been added'.format(name),
+                                 hook)
         ret['changes']['Hook'] = 'Created'
     return ret
 
 ## user present
+@_profiles
 def user_present(username, name, email, password, **connection_args):
     ''''
     Ensures that the gitlab user exists
@@ -269,6 +462,7 @@ def user_present(username, name, email, password, **connection_args):
         ret['changes']['User'] = 'Created'
     return ret
 
+@_profiles
 def branch_present(project, name, ref, **connection_args):
     '''
     Ensure branch present in Gitlab project
@@ -288,7 +482,6 @@ def branch_present(project, name, ref, **connection_args):
     # Check if branch is already present
     branch = __salt__['gitlab.branch_get'](name, project, **connection_args)
 
-    print "___DEBUG___ branch is {0}".format(branch)
     if 'Error' not in branch:
         return ret
     else:
@@ -297,3 +490,410 @@ def branch_present(project, name, ref, **connection_args):
         ret['comment'] = 'Branch "{0}" has been added'.format(name)
         ret['changes']['Branch'] = 'Created'
     return ret
+
+@_profiles
+def branches_present(name, branches, ref='master', **connection_args):
+    '''
+    Ensure several branches present in Gitlab project
+
+    name
+        path to project, i.e. namespace/repo-name
+
+    branches
+        list of branch names, or of mappings of branch name to the ref
+        to create it from
+
+    ref
+        ref used for branches given without one, defaults to master
+
+    '''
+    ret = {'name': name,
+           'changes': {},
+           'result': True,
+           'comment': 'All branches already exist in project {0}'.format(name)}
+
+    branches = __salt__['gitlab.branches_create'](name, branches, ref=ref,
+                                                  **connection_args)
+    if 'Error' in branches:
+        ret['result'] = False
+        ret['comment'] = branches['Error']
+        return ret
+
+    created = []
+    failed = []
+    for branch, result in branches.items():
+        if 'Error' in result:
+            failed.append(result['Error'])
+        elif result['created']:
+            created.append(branch)
+            ret['changes'][branch] = 'Created from {0}'.format(result['ref'])
+    if failed:
+        ret['result'] = False
+        ret['comment'] = '; '.join(failed)
+    elif created:
+        ret['comment'] = 'Branches "{0}" have been added'.format(
+            '", "'.join(sorted(created)))
+    return ret
+
+
+def _group_ret(ret, results, item):
+    '''
+    Fill in a state return from the per-project outcomes of a group
+    operation
+    '''
+    if 'Error' in results:
+        ret['result'] = False
+        ret['comment'] = results['Error']
+        return ret
+    failed = []
+    for project, result in sorted(results.items()):
+        if 'Error' in result:
+            failed.append('{0}: {1}'.format(project, result['Error']))
+        elif result['created']:
+            ret['changes'][project] = 'Created'
+    if failed:
+        ret['result'] = False
+        ret['comment'] = '; '.join(failed)
+    elif ret['changes']:
+        ret['comment'] = '{0} has been added to {1} projects'.format(
+            item, len(ret['changes']))
+    return ret
+
+
+@_profiles
+def group_hook_present(name, group, include_subgroups=False, **connection_args):
+    '''
+    Ensure hook present in every project of a Gitlab group
+
+    name
+        The URL of hook
+
+    group
+        path to group, i.e. namespace
+
+    include_subgroups
+        also manage the projects of the group's subgroups
+
+    '''
+    ret = {'name': name,
+           'changes': {},
+           'result': True,
+           'comment': 'Hook "{0}" already exists in all projects of group {1}'.format(name, group)}
+
+    results = __salt__['gitlab.group_hook_create'](group, name,
+                                                   include_subgroups=include_subgroups,
+                                                   **connection_args)
+    return _group_ret(ret, results, 'Hook "{0}"'.format(name))
+
+
+@_profiles
+def group_deploykey_present(name, key, group, include_subgroups=False,
+                            **connection_args):
+    '''
+    Ensure deploy key present in every project of a Gitlab group
+
+    name
+        The title of the key
+
+    key
+        SSH public key
+
+    group
+        path to group, i.e. namespace
+
+    include_subgroups
+        also manage the projects of the group's subgroups
+
+    '''
+    ret = {'name': name,
+           'changes': {},
+           'result': True,
+           'comment': 'Deploy key "{0}" already exists in all projects of group {1}'.format(name, group)}
+
+    if key.startswith('/'):
+        with open(key) as f:
+            key = f.read()
+
+    results = __salt__['gitlab.group_deploykey_create'](group, name, key,
+                                                        include_subgroups=include_subgroups,
+                                                        **connection_args)
+    return _group_ret(ret, results, 'Deploy key "{0}"'.format(name))
+
+
+@_profiles
+def group_branches_present(name, branches, ref='master',
+                           include_subgroups=False, **connection_args):
+    '''
+    Ensure several branches present in every project of a Gitlab group
+
+    name
+        path to group, i.e. namespace
+
+    branches
+        list of branch names, or of mappings of branch name to the ref
+        to create it from
+
+    ref
+        ref used for branches given without one, defaults to master
+
+    include_subgroups
+        also manage the projects of the group's subgroups
+
+    '''
+    ret = {'name': name,
+           'changes': {},
+           'result': True,
+           'comment': 'All branches already exist in all projects of group {0}'.format(name)}
+
+    results = __salt__['gitlab.group_branches_create'](name, branches, ref=ref,
+                                                       include_subgroups=include_subgroups,
+                                                       **connection_args)
+    if 'Error' in results:
+        ret['result'] = False
+        ret['comment'] = results['Error']
+        return ret
+
+    failed = []
+    for project, project_branches in sorted(results.items()):
+        if 'Error' in project_branches:
+            failed.append('{0}: {1}'.format(project, project_branches['Error']))
+            continue
+        for branch, result in project_branches.items():
+            if 'Error' in result:
+                failed.append('{0}: {1}'.format(project, result['Error']))
+            elif result['created']:
+                ret['changes'].setdefault(project, {})[branch] = \
+                    'Created from {0}'.format(result['ref'])
+    if failed:
+        ret['result'] = False
+        ret['comment'] = '; '.join(failed)
+    elif ret['changes']:
+        ret['comment'] = 'Branches have been added to {0} projects'.format(
+            len(ret['changes']))
+    return ret
+
+
+@_profiles
+def users_managed(name, users, block_unmanaged=False, **connection_args):
+    '''
+    Ensure that a whole list of gitlab users exists, typically taken from
+    pillar. Existing users are read once and only the needed creates and
+    updates are made.
+
+    name
+        An identifier for this set of users
+
+    users
+        list of users, each a mapping with username, name, email and
+        password. The password is only used when creating the user.
+
+    block_unmanaged
+        block the active users that are not in the list
+    '''
+    ret = {'name': name,
+           'changes': {},
+           'result': True,
+           'comment': 'All users are already in the desired state'}
+
+    results = __salt__['gitlab.users_sync'](users,
+                                            block_unmanaged=block_unmanaged,
+                                            **connection_args)
+    failed = []
+    for username, result in sorted(results.items()):
+        if 'Error' in result:
+            failed.append(result['Error'])
+        elif result['action']:
+            ret['changes'][username] = dict(result['changes'],
+                                            action=result['action'])
+    if failed:
+        ret['result'] = False
+        ret['comment'] = '; '.join(failed)
+    elif ret['changes']:
+        ret['comment'] = '{0} users have been changed'.format(
+            len(ret['changes']))
+    return ret
+
+
+def _members(name, members, projects, groups, remove_unmanaged,
+             **connection_args):
+    ret = {'name': name,
+           'changes': {},
+           'result': True,
+           'comment': 'All members are already in the desired state'}
+    if not projects and not groups:
+        projects = [name]
+
+    results = __salt__['gitlab.members_sync'](members,
+                                              projects=projects,
+                                              groups=groups,
+                                              remove_unmanaged=remove_unmanaged,
+                                              **connection_args)
+    failed = []
+    changed = 0
+    api_calls = 0
+    for target, result in sorted(results.items()):
+        if 'Error' in result:
+            failed.append(result['Error'])
+            continue
+        failed.extend('{0}: {1}'.format(target, error)
+                      for error in result['errors'])
+        api_calls += result['api_calls']
+        for action in ('added', 'updated', 'removed'):
+            if result[action]:
+                ret['changes'].setdefault(target, {})[action] = result[action]
+                changed += len(result[action])
+    if failed:
+        ret['result'] = False
+        ret['comment'] = '; '.join(failed)
+    elif changed:
+        ret['comment'] = '{0} memberships have been changed'.format(changed)
+    ret['comment'] += ' ({0} API calls)'.format(api_calls)
+    return ret
+
+
+@_profiles
+def members_present(name, members, projects=None, groups=None,
+                    **connection_args):
+    '''
+    Ensure users are members of Gitlab projects or groups with the given
+    access level. Other members are left alone.
+
+    name
+        path to project, i.e. namespace/repo-name, unless projects or
+        groups are given
+
+    members
+        mapping of username to access level, i.e. developer
+
+    projects
+        list of project paths to manage
+
+    groups
+        list of group paths to manage
+    '''
+    return _members(name, members, projects, groups, False, **connection_args)
+
+
+@_profiles
+def members_managed(name, members, projects=None, groups=None,
+                    **connection_args):
+    '''
+    Ensure the members of Gitlab projects or groups are exactly the given
+    users with the given access level. Other members are removed.
+
+    name
+        path to project, i.e. namespace/repo-name, unless projects or
+        groups are given
+
+    members
+        mapping of username to access level, i.e. developer
+
+    projects
+        list of project paths to manage
+
+    groups
+        list of group paths to manage
+    '''
+    return _members(name, members, projects, groups, True, **connection_args)
+
+
+@_profiles
+def flushed(name, **connection_args):
+    '''
+    Make the Gitlab writes queued by the previous states (see
+    ``gitlab.write_queue``). Place it after them, i.e. with ``order: last``.
+
+    name
+        An identifier for this flush
+    '''
+    ret = {'name': name,
+           'changes': {},
+           'result': True,
+           'comment': 'No queued writes to flush'}
+
+    results = __salt__['gitlab.flush'](**connection_args)
+    failed = []
+    for key, result in sorted(results.items()):
+        if 'Error' in result:
+            failed.append('{0}: {1}'.format(key, result['Error']))
+        elif result['action']:
+            ret['changes'][key] = result['action'].capitalize()
+    if failed:
+        ret['result'] = False
+        ret['comment'] = '; '.join(failed)
+    elif results:
+        ret['comment'] = '{0} queued writes flushed, {1} made changes'.format(
+            len(results), len(ret['changes']))
+    return ret
+
+
+@_profiles
+def project_imported(name, import_url, description=None, **connection_args):
+    '''
+    Ensures that the gitlab project exists, importing it from import_url
+    when missing. The import is only started; a later
+    ``gitlab.jobs_finished`` state waits for every import together.
+
+    name
+        path to project, i.e. namespace/repo-name
+
+    import_url
+        URL of the repository to import
+
+    description
+        The description to use for this project
+    '''
+    ret = {'name': name,
+           'changes': {},
+           'result': True,
+           'comment': 'Tenant "{0}" already exists'.format(name)}
+
+    project = __salt__['gitlab.project_get'](name=name, **connection_args)
+    if 'Error' not in project:
+        return ret
+
+    job = __salt__['gitlab.project_import_submit'](name, import_url,
+                                                   description=description,
+                                                   **connection_args)
+    if 'Error' in job:
+        ret['result'] = False
+        ret['comment'] = job['Error']
+        return ret
+    ret['comment'] = 'Import of tenant "{0}" has been started'.format(name)
+    ret['changes']['Tenant'] = 'Importing'
+    return ret
+
+
+@_profiles
+def jobs_finished(name, timeout=600, **connection_args):
+    '''
+    Wait for the Gitlab imports, deletions and mirror updates started by
+    the previous states to finish, polling them all together
+
+    name
+        An identifier for this wait
+
+    timeout
+        How long to wait, in seconds
+    '''
+    ret = {'name': name,
+           'changes': {},
+           'result': True,
+           'comment': 'No Gitlab jobs to wait for'}
+
+    results = __salt__['gitlab.wait'](timeout=timeout, **connection_args)
+    failed = []
+    for job_id, status in sorted(results.items()):
+        if status['state'] == 'failed':
+            failed.append('{0}: {1}'.format(job_id, status.get('Error')))
+        elif status['state'] == 'running':
+            failed.append('{0}: still running after {1}s'.format(job_id,
+                                                                timeout))
+        else:
+            ret['changes'][job_id] = 'Finished'
+    if failed:
+        ret['result'] = False
+        ret['comment'] = '; '.join(failed)
+    elif results:
+        ret['comment'] = '{0} Gitlab jobs have finished'.format(len(results))
+    return ret
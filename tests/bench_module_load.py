@@ -0,0 +1,75 @@
+#!/usr/local/bin/python
+'''
+Measure how long a minion takes to load its execution modules with and
+without the gitlab module present.
+
+Each load runs in a fresh interpreter so import caches do not carry over.
+Without Salt installed, only the import of the module file and its
+__virtual__ are timed.
+'''
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+runs = 10
+module = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', 'modules', 'gitlab.py')
+
+with_salt = '''
+import time
+import salt.config
+import salt.loader
+opts = salt.config.minion_config(None)
+opts['module_dirs'] = [{0!r}]
+start = time.time()
+mods = salt.loader.minion_mods(opts)
+mods._load_all()
+print(time.time() - start)
+'''
+
+without_salt = '''
+import os
+import time
+import importlib.util
+start = time.time()
+if os.path.exists({0!r}):
+    spec = importlib.util.spec_from_file_location('gitlab_module', {0!r})
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    mod.__virtual__()
+print(time.time() - start)
+'''
+
+
+def timed(code):
+    times = []
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, '-c', code])
+        times.append(float(out.decode().split()[-1]))
+    return min(times), sum(times) / len(times)
+
+
+try:
+    import salt.loader
+    have_salt = True
+except ImportError:
+    have_salt = False
+
+empty = tempfile.mkdtemp()
+present = tempfile.mkdtemp()
+shutil.copy(module, present)
+try:
+    for label, directory in (('without gitlab', empty),
+                             ('with gitlab', present)):
+        if have_salt:
+            code = with_salt.format(directory)
+        else:
+            code = without_salt.format(os.path.join(directory, 'gitlab.py'))
+        best, mean = timed(code)
+        print('{0:15} best {1:.4f}s  mean {2:.4f}s'.format(label, best, mean))
+finally:
+    shutil.rmtree(empty)
+    shutil.rmtree(present)
@@ -0,0 +1,121 @@
+'''
+Fixtures running the gitlab execution module against a local stand-in for
+the Gitlab API.
+'''
+
+import importlib.util
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MODULE = os.path.join(ROOT, 'modules', 'gitlab.py')
+STATE = os.path.join(ROOT, 'states', 'gitlab.py')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    '''
+    Serve the routes of the server: either a list of pages, each a list of
+    items or an HTTP error status, or a function of the query and body
+    returning a status and a body.
+    '''
+
+    def do_GET(self):
+        self._serve('GET')
+
+    def do_POST(self):
+        self._serve('POST')
+
+    def do_PUT(self):
+        self._serve('PUT')
+
+    def do_DELETE(self):
+        self._serve('DELETE')
+
+    def _serve(self, method):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.server.requests.append((method, url.path, query, body))
+
+        route = self.server.routes.get((method, url.path))
+        headers = {}
+        if route is None:
+            status, data = 404, {'message': '404 Not found'}
+        elif callable(route):
+            status, data = route(query, body)
+        else:
+            page = int(query.get('page', ['1'])[0])
+            data = route[page - 1]
+            status = 200
+            if isinstance(data, int):
+                status, data = data, {'message': 'error'}
+            headers['X-Next-Page'] = str(page + 1) if page < len(route) else ''
+
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def gitlab_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.routes = {}
+    server.requests = []
+    server.url = 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def gitlab_config(gitlab_server):
+    return {'gitlab.url': gitlab_server.url,
+            'gitlab.token': 'secret',
+            'gitlab.workers': 4}
+
+
+@pytest.fixture
+def gitlab_module(gitlab_config):
+    pytest.importorskip('salt')
+    pytest.importorskip('gitlab')
+    pytest.importorskip('requests')
+    spec = importlib.util.spec_from_file_location('gitlab_module', MODULE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.__salt__ = {
+        'config.get': lambda key, default=None: gitlab_config.get(key,
+                                                                  default),
+    }
+    module.__context__ = {}
+    return module
+
+
+@pytest.fixture
+def gitlab_state(gitlab_module):
+    spec = importlib.util.spec_from_file_location('gitlab_state', STATE)
+    state = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(state)
+    state.__salt__ = dict(
+        ('gitlab.{0}'.format(name), func)
+        for name, func in vars(gitlab_module).items()
+        if callable(func) and not name.startswith('_'))
+    state.__salt__.update(gitlab_module.__salt__)
+    state.__context__ = gitlab_module.__context__
+    return state
@@ -0,0 +1,66 @@
+'''
+The asyncio and thread pool backends of the *_list_all functions must give
+the same results.
+'''
+
+import pytest
+
+pytest.importorskip('aiohttp')
+CommandExecutionError = pytest.importorskip('salt.exceptions').CommandExecutionError
+
+BACKENDS = ('threads', 'asyncio')
+
+
+@pytest.fixture
+def inventory(gitlab_server):
+    routes = gitlab_server.routes
+    routes[('GET', '/api/v3/projects')] = [
+        [{'id': 1, 'path_with_namespace': 'ns/one'}],
+        [{'id': 2, 'path_with_namespace': 'ns/two'}],
+    ]
+    routes[('GET', '/api/v3/projects/1/hooks')] = [
+        [{'id': 11, 'url': 'https://ci/1'}, {'id': 12, 'url': 'https://ci/2'}],
+        [{'id': 13, 'url': 'https://ci/3'}],
+    ]
+    routes[('GET', '/api/v3/projects/2/hooks')] = [
+        [{'id': 21, 'url': 'https://ci/1'}],
+    ]
+    routes[('GET', '/api/v3/projects/1/keys')] = [[]]
+    routes[('GET', '/api/v3/projects/2/keys')] = [
+        [{'id': 31, 'title': 'deploy'}],
+        [{'id': 32, 'title': 'backup'}],
+        [{'id': 33, 'title': 'mirror'}],
+    ]
+    return routes
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_hook_list_all(gitlab_module, inventory, backend):
+    hooks = gitlab_module.hook_list_all(backend=backend)
+    assert sorted(hooks) == ['ns/one', 'ns/two']
+    assert sorted(hooks['ns/one']) == ['https://ci/1', 'https://ci/2',
+                                       'https://ci/3']
+    assert hooks['ns/two'] == {'https://ci/1': {'id': 21,
+                                                'url': 'https://ci/1'}}
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_deploykey_list_all(gitlab_module, inventory, backend):
+    keys = gitlab_module.deploykey_list_all(projects=['ns/one', 'ns/two'],
+                                            backend=backend)
+    assert keys['ns/one'] == {}
+    assert sorted(keys['ns/two']) == ['backup', 'deploy', 'mirror']
+
+
+def test_backends_match(gitlab_module, inventory):
+    for list_all in (gitlab_module.hook_list_all,
+                     gitlab_module.deploykey_list_all):
+        assert list_all(backend='threads') == list_all(backend='asyncio')
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_failed_page_raises(gitlab_module, inventory, backend):
+    inventory[('GET', '/api/v3/projects/2/keys')][1] = 500
+    with pytest.raises(CommandExecutionError) as exc:
+        gitlab_module.deploykey_list_all(backend=backend)
+    assert str(exc.value) == 'Unable to list projects/2/keys (page 2): HTTP 500'
@@ -0,0 +1,54 @@
+'''
+Drift checks must report what differs from pillar, and fire events only
+for what changed since the previous check.
+'''
+
+import pytest
+
+KEY = 'ssh-rsa AAAAB3NzaC1yc2E deploy@ci'
+
+
+@pytest.fixture
+def events(gitlab_module, gitlab_server, tmp_path):
+    events = []
+    pillar = {'projects': {'ns/one': {
+        'description': 'one',
+        'hooks': ['http://h'],
+        'deploykeys': {'deploy': KEY},
+    }}}
+    gitlab_module.__salt__.update({
+        'pillar.get': lambda key, default=None: pillar,
+        'event.send': lambda tag, data: events.append((tag, data)),
+    })
+    gitlab_module.__opts__ = {'cachedir': str(tmp_path)}
+    routes = gitlab_server.routes
+    routes[('GET', '/api/v3/projects')] = [
+        [{'id': 1, 'path_with_namespace': 'ns/one', 'description': 'one'}]]
+    routes[('GET', '/api/v3/projects/1/hooks')] = [[]]
+    routes[('GET', '/api/v3/projects/1/keys')] = [
+        [{'id': 2, 'title': 'deploy', 'key': 'ssh-rsa OLD deploy@ci'}]]
+    return events
+
+
+def test_drift_events(gitlab_module, gitlab_server, events):
+    first = gitlab_module.drift()
+    assert first['drift'] == {
+        'hook:ns/one:http://h': {'drift': 'missing'},
+        'deploykey:ns/one:deploy': {'drift': 'changed',
+                                    'key': 'ssh-rsa OLD deploy@ci'},
+    }
+    assert first['new'] == ['deploykey:ns/one:deploy',
+                            'hook:ns/one:http://h']
+    assert first['resolved'] == []
+    assert [tag for tag, _ in events] == ['gitlab/drift/new'] * 2
+
+    routes = gitlab_server.routes
+    routes[('GET', '/api/v3/projects/1/keys')] = [
+        [{'id': 2, 'title': 'deploy', 'key': KEY + '\n'}]]
+    del events[:]
+    second = gitlab_module.drift()
+    assert second['drift'] == {'hook:ns/one:http://h': {'drift': 'missing'}}
+    assert second['new'] == []
+    assert second['resolved'] == ['deploykey:ns/one:deploy']
+    assert events == [('gitlab/drift/resolved',
+                        {'id': 'deploykey:ns/one:deploy'})]
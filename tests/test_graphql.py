@@ -0,0 +1,126 @@
+'''
+Reads through the GraphQL backend must give the same results as the REST
+API, and fall back to it when GraphQL cannot serve them.
+'''
+
+import json
+
+import pytest
+
+CommandExecutionError = pytest.importorskip('salt.exceptions').CommandExecutionError
+
+PROJECTS = [
+    {'id': n, 'name': 'repo{0}'.format(n), 'path': 'repo{0}'.format(n),
+     'path_with_namespace': 'ns/repo{0}'.format(n),
+     'description': 'project {0}'.format(n), 'star_count': n}
+    for n in range(1, 6)
+]
+USERS = [
+    {'id': n, 'name': 'User {0}'.format(n), 'username': 'user{0}'.format(n),
+     'state': 'active', 'email': 'user{0}@example.com'.format(n)}
+    for n in range(1, 4)
+]
+GRAPHQL = {
+    'projects': [dict(id='gid://gitlab/Project/{0}'.format(p['id']),
+                      name=p['name'], path=p['path'],
+                      fullPath=p['path_with_namespace'],
+                      description=p['description'])
+                 for p in PROJECTS],
+    'users': [dict(id='gid://gitlab/User/{0}'.format(u['id']),
+                   name=u['name'], username=u['username'], state=u['state'])
+              for u in USERS],
+}
+
+
+class _GraphQL(object):
+    '''
+    Serve projects and users two at a time, with the cursor being the
+    offset of the next page. Cursors listed in ``fail`` get an error.
+    '''
+
+    def __init__(self):
+        self.fail = set()
+        self.queries = []
+
+    def __call__(self, query, body):
+        request = json.loads(body.decode('utf-8'))
+        self.queries.append(request)
+        kind = 'projects' if '{ projects(' in request['query'] else 'users'
+        after = request['variables'].get('after')
+        if after in self.fail:
+            return 200, {'errors': [{'message': 'Internal server error'}]}
+        start = int(after or 0)
+        end = start + 2
+        nodes = GRAPHQL[kind][start:end]
+        return 200, {'data': {kind: {
+            'nodes': nodes,
+            'pageInfo': {'endCursor': str(end),
+                         'hasNextPage': end < len(GRAPHQL[kind])}}}}
+
+
+@pytest.fixture
+def graphql(gitlab_server, gitlab_config):
+    gitlab_config['gitlab.read_backend'] = 'graphql'
+    endpoint = _GraphQL()
+    routes = gitlab_server.routes
+    routes[('POST', '/api/graphql')] = endpoint
+    routes[('GET', '/api/v3/projects')] = [PROJECTS[:3], PROJECTS[3:]]
+    routes[('GET', '/api/v3/users')] = [USERS[:2], USERS[2:]]
+    return endpoint
+
+
+def _rest_requests(server, path):
+    return [r for r in server.requests if r[:2] == ('GET', path)]
+
+
+def test_cursor_pagination(gitlab_module, gitlab_server, graphql):
+    fields = ['id', 'path_with_namespace']
+    projects = gitlab_module.project_list(fields=fields)
+    assert sorted(p['id'] for p in projects.values()) == [1, 2, 3, 4, 5]
+    assert [q['variables'].get('after') for q in graphql.queries] == \
+        [None, '2', '4']
+    assert all('projects(membership: true, ' in q['query']
+               for q in graphql.queries)
+    assert not _rest_requests(gitlab_server, '/api/v3/projects')
+
+
+@pytest.mark.parametrize('kind,fields', [
+    ('projects', ['id', 'name', 'path_with_namespace', 'description']),
+    ('users', ['id', 'name', 'username', 'state']),
+])
+def test_matches_rest(gitlab_module, gitlab_config, graphql, kind, fields):
+    list_func = getattr(gitlab_module, kind[:-1] + '_list')
+    via_graphql = list_func(fields=fields)
+    assert graphql.queries
+    gitlab_config['gitlab.read_backend'] = 'rest'
+    gitlab_module.__context__.clear()
+    assert list_func(fields=fields) == via_graphql
+
+
+def test_fallback_on_error(gitlab_module, gitlab_server, graphql):
+    graphql.fail.add(None)
+    users = gitlab_module.user_list(fields=['id', 'username'])
+    assert sorted(u['username'] for u in users.values()) == \
+        ['user1', 'user2', 'user3']
+    assert _rest_requests(gitlab_server, '/api/v3/users')
+
+
+def test_fallback_on_unmapped_field(gitlab_module, gitlab_server, graphql):
+    users = gitlab_module.user_list(fields=['id', 'email'])
+    assert users['User 1'] == {'name': 'User 1', 'id': 1,
+                               'email': 'user1@example.com'}
+    assert not graphql.queries
+
+
+def test_fallback_without_fields(gitlab_module, gitlab_server, graphql):
+    projects = gitlab_module.project_list()
+    assert projects['repo1'] == PROJECTS[0]
+    assert not graphql.queries
+
+
+def test_failed_later_page_raises(gitlab_module, graphql):
+    graphql.fail.add('4')
+    with pytest.raises(CommandExecutionError) as exc:
+        gitlab_module.project_list(fields=['id'])
+    assert str(exc.value) == \
+        'Unable to list projects through GraphQL after cursor 4'
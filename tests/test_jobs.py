@@ -0,0 +1,70 @@
+'''
+Jobs must be polled through the endpoints of the API version in use.
+'''
+
+import pytest
+
+
+@pytest.fixture
+def project(gitlab_server):
+    statuses = ['started', 'started', 'finished']
+
+    def _project(query, body):
+        return 200, {'id': 5, 'import_status': statuses.pop(0)}
+
+    gitlab_server.routes[('GET', '/api/v3/projects/5')] = _project
+    return statuses
+
+
+def _job(kind):
+    return {'id': '{0}:ns/repo'.format(kind), 'kind': kind,
+            'name': 'ns/repo', 'project_id': 5}
+
+
+def test_import_status(gitlab_module, project):
+    assert gitlab_module.job_status(_job('import')) == {'state': 'running'}
+
+
+def test_wait_for_import(gitlab_module, project, monkeypatch):
+    monkeypatch.setattr(gitlab_module.time, 'sleep', lambda seconds: None)
+    assert gitlab_module.wait([_job('import')]) == {
+        'import:ns/repo': {'state': 'finished'}}
+    assert not project
+
+
+def test_missing_project_fails(gitlab_module, gitlab_server):
+    assert gitlab_module.job_status(_job('import')) == {
+        'state': 'failed', 'Error': 'Project 5 no longer exists'}
+    assert gitlab_module.job_status(_job('delete')) == {'state': 'finished'}
+
+
+def test_mirror_needs_v4(gitlab_module, gitlab_server):
+    assert gitlab_module.project_mirror_submit('ns/repo') == {
+        'Error': 'Updating mirrors needs Gitlab API v4 '
+                 '(gitlab.api_version: 4)'}
+    assert not gitlab_server.requests
+
+
+@pytest.fixture
+def v4(gitlab_server, gitlab_config):
+    gitlab_config['gitlab.api_version'] = 4
+    routes = gitlab_server.routes
+    routes[('GET', '/api/v4/projects')] = [
+        [{'id': 5, 'name': 'repo', 'path_with_namespace': 'ns/repo'}]]
+    routes[('POST', '/api/v4/projects/5/mirror/pull')] = \
+        lambda query, body: (200, {})
+    routes[('GET', '/api/v4/projects/5/import')] = \
+        lambda query, body: (200, {'id': 5, 'import_status': 'failed',
+                                   'import_error': 'Unreachable'})
+    return routes
+
+
+def test_mirror_on_v4(gitlab_module, gitlab_server, v4):
+    job = gitlab_module.project_mirror_submit('ns/repo')
+    assert job == _job('mirror')
+    assert gitlab_module.job_status(job) == {'state': 'failed',
+                                             'Error': 'Unreachable'}
+    assert [r[:2] for r in gitlab_server.requests] == [
+        ('GET', '/api/v4/projects'),
+        ('POST', '/api/v4/projects/5/mirror/pull'),
+        ('GET', '/api/v4/projects/5/import')]
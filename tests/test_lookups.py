@@ -0,0 +1,37 @@
+'''
+Lookups must see every page of a listing, and keep the pooled connections
+open.
+'''
+
+
+def test_hooks_and_keys_paginate(gitlab_module, gitlab_server):
+    routes = gitlab_server.routes
+    routes[('GET', '/api/v3/projects/1')] = \
+        lambda query, body: (200, {'id': 1, 'name': 'one'})
+    routes[('GET', '/api/v3/projects/1/hooks')] = [
+        [{'id': n, 'url': 'http://h/{0}'.format(n)} for n in range(20)],
+        [{'id': 20, 'url': 'http://h/20'}],
+    ]
+    routes[('GET', '/api/v3/projects/1/keys')] = [
+        [{'id': 1, 'title': 'deploy'}], [{'id': 2, 'title': 'backup'}]]
+    assert len(gitlab_module.hook_list(project_id=1)) == 21
+    assert gitlab_module.hook_get('http://h/20', project_id=1) == {
+        'http://h/20': {'id': 20, 'url': 'http://h/20'}}
+    assert sorted(gitlab_module.deploykey_list(project_id=1)) == [
+        'backup', 'deploy']
+    assert gitlab_module.deploykey_get('backup', project_id=1) == {
+        'backup': {'id': 2, 'title': 'backup'}}
+
+
+def test_password_login_keeps_connections(gitlab_module, gitlab_server,
+                                          gitlab_config):
+    del gitlab_config['gitlab.token']
+    gitlab_config.update({'gitlab.user': 'root', 'gitlab.password': 'pw'})
+    routes = gitlab_server.routes
+    routes[('POST', '/api/v3/session')] = \
+        lambda query, body: (201, {'private_token': 'secret'})
+    git = gitlab_module.auth()
+    assert git.headers['connection'] == 'close'
+    headers = gitlab_module._session(git).headers
+    assert headers['PRIVATE-TOKEN'] == 'secret'
+    assert 'close' not in headers.get('Connection', '')
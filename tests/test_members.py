@@ -0,0 +1,59 @@
+'''
+members_sync must make only the needed member changes, and count the API
+calls each project makes, also when several are synced in parallel.
+'''
+
+import pytest
+
+MEMBERS = {'alice': 'maintainer', 'bob': 'developer', 'dave': 30,
+           'erin': 'Developer'}
+
+
+@pytest.fixture
+def members(gitlab_server):
+    routes = gitlab_server.routes
+    routes[('GET', '/api/v3/projects')] = [[
+        {'id': 1, 'path_with_namespace': 'ns/one'},
+        {'id': 2, 'path_with_namespace': 'ns/two'}]]
+    routes[('GET', '/api/v3/users')] = [[
+        {'id': 10, 'username': 'alice'},
+        {'id': 11, 'username': 'bob'},
+        {'id': 12, 'username': 'carol'},
+        {'id': 14, 'username': 'erin'}]]
+    routes[('GET', '/api/v3/projects/1/members')] = [[
+        {'id': 10, 'username': 'alice', 'access_level': 30},
+        {'id': 12, 'username': 'carol', 'access_level': 20}]]
+    routes[('GET', '/api/v3/projects/2/members')] = [[]]
+    for project in (1, 2):
+        routes[('POST', '/api/v3/projects/{0}/members'.format(project))] = \
+            lambda query, body: (201, {'id': 1})
+    routes[('PUT', '/api/v3/projects/1/members/10')] = \
+        lambda query, body: (200, {'id': 10})
+    routes[('DELETE', '/api/v3/projects/1/members/12')] = \
+        lambda query, body: (200, {'id': 12})
+    return routes
+
+
+def test_one_project(gitlab_module, gitlab_server, members):
+    result = gitlab_module.members_sync(MEMBERS, projects=['ns/one'],
+                                        remove_unmanaged=True)
+    assert result == {'ns/one': {
+        'added': ['bob'],
+        'updated': ['alice'],
+        'removed': ['carol'],
+        'errors': ['Unknown user dave',
+                   'Unknown access level Developer for user erin'],
+        'api_calls': 6,
+    }}
+    assert len(gitlab_server.requests) == 6
+
+
+def test_parallel_projects(gitlab_module, gitlab_server, members):
+    result = gitlab_module.members_sync({'alice': 40, 'bob': 'developer'},
+                                        projects=['ns/one', 'ns/two'])
+    assert result['ns/one']['updated'] == ['alice']
+    assert result['ns/one']['added'] == ['bob']
+    assert sorted(result['ns/two']['added']) == ['alice', 'bob']
+    # The shared indexes are counted once, by whichever project listed them
+    assert sum(ret['api_calls'] for ret in result.values()) == \
+        len(gitlab_server.requests) == 8
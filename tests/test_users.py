@@ -0,0 +1,53 @@
+'''
+User lookups must see every user, and users_sync must report bad entries
+per user.
+'''
+
+from urllib.parse import parse_qs
+
+import pytest
+
+USERS = [{'id': n, 'username': 'user{0}'.format(n),
+          'name': 'User {0}'.format(n),
+          'email': 'user{0}@example.com'.format(n), 'state': 'active'}
+         for n in range(1, 26)]
+
+
+def _saved(status):
+    def _save(query, body):
+        user = dict((key, value[0]) for key, value in
+                    parse_qs(body.decode('utf-8')).items())
+        return status, dict(user, id=99)
+    return _save
+
+
+@pytest.fixture
+def users(gitlab_server):
+    routes = gitlab_server.routes
+    routes[('GET', '/api/v3/users')] = [USERS[:20], USERS[20:]]
+    routes[('POST', '/api/v3/users')] = _saved(201)
+    routes[('PUT', '/api/v3/users/25')] = _saved(200)
+    return routes
+
+
+def test_user_get_past_first_page(gitlab_module, users):
+    assert gitlab_module.user_get(username='user25') == {'user25': USERS[24]}
+
+
+def test_sync_reports_incomplete_entries(gitlab_module, gitlab_server,
+                                         users):
+    result = gitlab_module.users_sync([
+        {'username': 'new', 'name': 'New', 'email': 'new@example.com',
+         'password': 'secret'},
+        {'username': 'nameless', 'email': 'nameless@example.com'},
+        {'username': 'lost', 'name': 'Lost'},
+        {'username': 'user25', 'name': 'Renamed'},
+    ])
+    assert result['new']['action'] == 'created'
+    assert result['nameless'] == {
+        'Error': 'Unable to create user nameless: no name'}
+    assert result['lost'] == {'Error': 'Unable to create user lost: no email'}
+    assert result['user25'] == {'action': 'updated',
+                                'changes': {'name': 'Renamed'}}
+    posted = [r for r in gitlab_server.requests if r[0] == 'POST']
+    assert len(posted) == 1
@@ -0,0 +1,158 @@
+'''
+Project writes, queued or not, must create projects under their namespace,
+and only re-create a replaced project once the old one is gone.
+'''
+
+from urllib.parse import parse_qs
+
+import pytest
+
+
+@pytest.fixture
+def queue(gitlab_server, gitlab_config):
+    gitlab_config['gitlab.write_queue'] = True
+    routes = gitlab_server.routes
+    routes[('GET', '/api/v3/projects')] = [
+        [{'id': 7, 'name': 'old', 'path_with_namespace': 'ns/old'}],
+    ]
+    routes[('GET', '/api/v3/namespaces')] = [[]]
+    routes[('POST', '/api/v3/groups')] = \
+        lambda query, body: (201, {'id': 40})
+    routes[('POST', '/api/v3/projects')] = \
+        lambda query, body: (201, {'id': 50})
+    return routes
+
+
+def _posted(server, path):
+    return [dict((key, value[0]) for key, value in
+                 parse_qs(body.decode('utf-8')).items())
+            for method, request_path, _, body in server.requests
+            if (method, request_path) == ('POST', path)]
+
+
+@pytest.mark.parametrize('queued', (True, False))
+def test_create_in_namespace(gitlab_module, gitlab_server, gitlab_config,
+                             queue, queued):
+    gitlab_config['gitlab.write_queue'] = queued
+    queue[('GET', '/api/v3/projects/50')] = \
+        lambda query, body: (200, {'id': 50, 'name': 'new'})
+    result = gitlab_module.project_create('ns/new', description='new')
+    if queued:
+        assert 'Queued' in result
+        result = gitlab_module.flush()
+        assert list(result.values()) == [{'action': 'created'}]
+    else:
+        assert result == {'new': {'id': 50, 'name': 'new'}}
+    assert _posted(gitlab_server, '/api/v3/groups') == [
+        {'name': 'ns', 'path': 'ns'}]
+    assert _posted(gitlab_server, '/api/v3/projects') == [
+        {'name': 'new', 'path': 'new', 'namespace_id': '40',
+         'description': 'new'}]
+
+
+def test_create_in_existing_namespace(gitlab_module, gitlab_server, queue):
+    queue[('GET', '/api/v3/namespaces')] = [
+        [{'id': 3, 'path': 'ns', 'full_path': 'team/ns'}],
+        [{'id': 4, 'path': 'ns', 'full_path': 'ns'}],
+    ]
+    gitlab_module.project_create('ns/new')
+    assert list(gitlab_module.flush().values()) == [{'action': 'created'}]
+    searches = [query for method, path, query, _ in gitlab_server.requests
+                if path == '/api/v3/namespaces']
+    assert [query['search'] for query in searches] == [['ns'], ['ns']]
+    assert not _posted(gitlab_server, '/api/v3/groups')
+    assert _posted(gitlab_server, '/api/v3/projects') == [
+        {'name': 'new', 'path': 'new', 'namespace_id': '4'}]
+
+
+def test_replace_waits_for_deletion(gitlab_module, gitlab_server, queue,
+                                    monkeypatch):
+    monkeypatch.setattr(gitlab_module.time, 'sleep', lambda seconds: None)
+    polls = []
+
+    def _project(query, body):
+        polls.append(query)
+        if len(polls) < 3:
+            return 200, {'id': 7, 'marked_for_deletion_at': '2026-10-18'}
+        return 404, {'message': '404 Project Not Found'}
+
+    queue[('DELETE', '/api/v3/projects/7')] = lambda query, body: (202, {})
+    queue[('GET', '/api/v3/projects/7')] = _project
+    gitlab_module.project_delete(name='ns/old')
+    gitlab_module.project_create('ns/old')
+    assert list(gitlab_module.flush().values()) == [{'action': 'created'}]
+    assert len(polls) == 3
+    assert _posted(gitlab_server, '/api/v3/projects') == [
+        {'name': 'old', 'path': 'old', 'namespace_id': '40'}]
+
+
+def test_replace_gives_up(gitlab_module, gitlab_server, queue, monkeypatch):
+    monkeypatch.setattr(gitlab_module.time, 'sleep', lambda seconds: None)
+    clock = iter(range(0, 1000, 5))
+    monkeypatch.setattr(gitlab_module.time, 'time', lambda: next(clock))
+    queue[('DELETE', '/api/v3/projects/7')] = lambda query, body: (202, {})
+    queue[('GET', '/api/v3/projects/7')] = \
+        lambda query, body: (200, {'id': 7})
+    gitlab_module.project_delete(name='ns/old')
+    gitlab_module.project_create('ns/old')
+    assert list(gitlab_module.flush().values()) == [
+        {'Error': 'Project ns/old is still being deleted'}]
+    assert not _posted(gitlab_server, '/api/v3/projects')
+
+
+def test_create_then_delete_existing_hook(gitlab_module, gitlab_server,
+                                          queue):
+    queue[('GET', '/api/v3/projects/7/hooks')] = [
+        [{'id': 3, 'url': 'http://h'}]]
+    queue[('DELETE', '/api/v3/projects/7/hooks/3')] = \
+        lambda query, body: (200, {'id': 3})
+    gitlab_module.hook_create('http://h', project_name='ns/old')
+    gitlab_module.hook_delete('http://h', project_name='ns/old')
+    assert gitlab_module.flush() == {
+        'hook:ns/old:http://h': {'action': 'deleted'}}
+    assert [r[:2] for r in gitlab_server.requests if r[0] == 'DELETE'] == [
+        ('DELETE', '/api/v3/projects/7/hooks/3')]
+
+
+def test_create_then_delete_missing_project(gitlab_module, gitlab_server,
+                                            queue):
+    gitlab_module.project_create('ns/new')
+    gitlab_module.project_delete(name='ns/new')
+    assert gitlab_module.flush() == {'project:ns/new': {'action': None}}
+    assert not [r for r in gitlab_server.requests if r[0] != 'GET']
+
+
+def test_present_reports_errors(gitlab_state, gitlab_server, gitlab_config,
+                                queue):
+    gitlab_config['gitlab.write_queue'] = False
+    queue[('POST', '/api/v3/projects')] = \
+        lambda query, body: (400, {'message': 'invalid'})
+    ret = gitlab_state.project_present('ns/new')
+    assert ret['result'] is False
+    assert ret['changes'] == {}
+    assert ret['comment'] == 'Unable to create project'
+
+
+def test_nested_namespace_needs_v4(gitlab_module, gitlab_server, queue):
+    assert gitlab_module.projects_create(['a/b/repo']) == {'a/b/repo': {
+        'Error': 'Nested namespaces need Gitlab API v4 '
+                 '(gitlab.api_version: 4): a/b'}}
+    assert not [r for r in gitlab_server.requests if r[0] == 'POST']
+
+
+def test_nested_namespace_on_v4(gitlab_module, gitlab_server, gitlab_config,
+                                queue):
+    gitlab_config['gitlab.api_version'] = 4
+    routes = gitlab_server.routes
+    routes[('GET', '/api/v4/projects')] = [[]]
+    routes[('GET', '/api/v4/namespaces')] = lambda query, body: (
+        200, [{'id': 3, 'path': 'a', 'full_path': 'a'}]
+        if query['search'] == ['a'] else [])
+    routes[('POST', '/api/v4/groups')] = lambda query, body: (201, {'id': 4})
+    routes[('POST', '/api/v4/projects')] = lambda query, body: (201, {'id': 5})
+    assert gitlab_module.projects_create(['a/b/repo']) == {
+        'a/b/repo': {'created': True, 'id': 5}}
+    assert _posted(gitlab_server, '/api/v4/groups') == [
+        {'name': 'b', 'path': 'b', 'parent_id': '3'}]
+    assert _posted(gitlab_server, '/api/v4/projects') == [
+        {'name': 'repo', 'path': 'repo', 'namespace_id': '4'}]